@@ -36,11 +36,65 @@ any case.
 
 Hold It! will write the output to a file named "holds_print_list.docx" in the
 user's Desktop directory, unless the -o option (/o on Windows) is given with
-an explicit file path to use instead.
+an explicit file path to use instead.  The pages in the document are in
+shelf order, sorted by the call numbers of the items.
+
+The Hold It! configuration file (holdit.ini) can define several profiles,
+one for each circulation desk, each with its own spreadsheet, TIND location
+codes, template and output file.  In that case, Hold It! logs in to TIND and
+gets the hold data once, and then processes the profiles in parallel, except
+that profiles that use the same spreadsheet are processed one after another.
+Each profile's document is written to "holds_print_list_NAME.docx" on the
+Desktop unless the profile sets its own output file.  The -n option (/n on
+Windows) followed by a comma-separated list of profile names limits the run
+to those profiles.
+
+If given the -L option (/L on Windows), Hold It! writes a separate Word
+document for each library location of the items, instead of one document
+for all of them.  The location code is added to the name of each file.
+
+Hold It! normally only adds new hold requests to the spreadsheet.  If given
+the -r option (/r on Windows), it will also update the rows of existing
+requests whose values in TIND (such as the holds count, overdue notices,
+loan status or location) have changed since the rows were added.  Only the
+cells whose values changed are written.
+
+If given the -X option (/X on Windows), Hold It! profiles its run using
+the Python cProfile module.  When the run finishes, the profile data is
+written to a file named "profile-DATE-TIME.prof" in the Hold It! user data
+folder, and the functions that took the most time are printed.  The file
+can be examined further using Python's pstats module or tools such as
+snakeviz.
 
 If given the -V option (/V on Windows), this program will print version
 information and exit without doing anything else.
 
+Hold It! also accepts an optional command name as its first argument.  The
+default command is "run", which performs the actions described above.  The
+command "archive" instead performs sheet maintenance: it moves rows that are
+older than the number of days given by the "max_age_days" setting in the
+"[archive]" section of holdit.ini, and whose Caltech status is one of the
+values listed by "closed_statuses", out of the main tracking sheet and into
+per-year archive tabs in the same spreadsheet.  Hold It! remembers locally
+which hold requests were archived, so that they are not mistaken for new
+requests on subsequent runs.
+
+Hold It! keeps a local history of the hold requests it has seen in TIND and
+in the Google spreadsheet.  The command "search", followed by one or more
+words, searches this history without connecting to any network service and
+prints the matching requests.  Each word matches the beginning of words in
+the requester names, item titles, barcodes, call numbers and Caltech
+statuses.  If the -j option (/j on Windows) is also given, the results are
+printed in JSON format.
+
+The command "stats" summarizes the same local history: the distribution of
+the time taken to handle hold requests (from the request date until Hold It!
+saw the status change to one of the "closed_statuses" in the spreadsheet),
+the number and age of open requests at each location, and the number of
+requests handled by each staff member.  The results are printed, in JSON
+format if the -j option is given, or written to the file given with the -o
+option, in CSV format if the file name ends in ".csv" and JSON otherwise.
+
 Authors
 -------
 
@@ -54,13 +108,21 @@ open-source software released under a 3-clause BSD license.  Please see the
 file "LICENSE" for more information.
 '''
 
+import cProfile
+from   concurrent.futures import ThreadPoolExecutor
 from   docxtpl import DocxTemplate
+from   itertools import chain
+import json
+import multiprocessing
 import os
 import os.path as path
 import plac
+import pstats
+import re
+import sqlite3
 import sys
 import time
-from   threading import Thread
+from   threading import Lock, Thread
 import traceback
 
 import holdit
@@ -68,16 +130,28 @@ from holdit.control import HoldItControlGUI, HoldItControlCLI
 from holdit.access import AccessHandlerGUI, AccessHandlerCLI
 from holdit.progress import ProgressIndicatorGUI, ProgressIndicatorCLI
 from holdit.messages import MessageHandlerGUI, MessageHandlerCLI
+from holdit.archive import ArchiveIndex, archive_selector, closed_statuses
+from holdit.archive import configure as configure_archive
 from holdit.config import Config
-from holdit.records import records_diff, records_filter
-from holdit.tind import records_from_tind
+from holdit.records import records_diff, records_filter, records_index
+from holdit.pipeline import stage
+from holdit.tind import records_from_tind, tind_session, configure as configure_tind
+from holdit.tind import on_shelf_or_lost
+from holdit.enrich import enrich_records, configure as configure_enrichment
+from holdit.enrich import enabled as enrichment_enabled
 from holdit.google_sheet import records_from_google, update_google, open_google
-from holdit.generate import printable_doc
-from holdit.network import network_available
+from holdit.google_sheet import archive_google, reconcile_google, prefetch_credentials
+from holdit.history import HoldHistory
+from holdit.generate import printable_doc, records_by_location, shelf_order
+from holdit.network import service_status
+from holdit.transport import configure as configure_transport
+from holdit.exporter import export_metrics, configure as configure_exporter
+from holdit.metrics import timed
 from holdit.files import readable, writable, open_file, rename_existing, file_in_use
 from holdit.files import desktop_path, module_path, holdit_path, delete_existing
+from holdit.files import user_data_path
 from holdit.exceptions import *
-from holdit.debug import set_debug, log
+from holdit.debug import set_debug, log, configure as configure_logging
 
 # The following is for fixing blurry fonts and controls in wxPython on Windows,
 # based on the solution by Nairen Zheng posted to Stack Overflow on
@@ -90,27 +164,54 @@ if sys.platform.startswith('win'):
     except:
         pass
 
+
+# Global constants.
+# ......................................................................
+
+_PROFILE_TOP = 25
+'''
+Number of functions listed in the summary printed when profiling is on.
+'''
+
+_COMMAND_HOSTS = {
+    'run'     : ['caltech.tind.io', 'idp.caltech.edu', 'sheets.googleapis.com'],
+    'archive' : ['sheets.googleapis.com'],
+}
+'''
+The hosts that each command needs to reach, which are checked before the
+command starts.
+'''
+
 
 # Main program.
 # ......................................................................
 
 @plac.annotations(
+    command    = ('command to perform: "run" (default), "archive", "search" or "stats"',
+                  'positional', None, str, ['run', 'archive', 'search', 'stats']),
     pswd       = ('Caltech access user password',                    'option', 'p'),
     user       = ('Caltech access user name',                        'option', 'u'),
     output     = ('write the output to the file "O"',                'option', 'o'),
+    profiles   = ('only use the profiles named in "N" (a,b,...)',    'option', 'n'),
     template   = ('use file "F" as the TIND record print template',  'option', 't'),
     debug      = ('turn on debugging (console only)',                'flag',   'D'),
     no_color   = ('do not color-code terminal output (default: do)', 'flag',   'C'),
     no_gui     = ('do not start the GUI interface (default: do)',    'flag',   'G'),
     no_keyring = ('do not use a keyring (default: do)',              'flag',   'K'),
     no_sheet   = ('do not open the spreadsheet (default: open it)',  'flag',   'S'),
+    reconcile  = ('update changed TIND values in existing rows',     'flag',   'r'),
+    split      = ('write a separate document for each location',     'flag',   'L'),
+    as_json    = ('print search results or statistics as JSON',      'flag',   'j'),
+    profile    = ('profile the run and print the slowest functions', 'flag',   'X'),
     reset      = ('reset keyring-stored user name and password',     'flag',   'R'),
     version    = ('print version info and exit',                     'flag',   'V'),
+    terms      = 'search terms for the "search" command',
 )
 
-def main(user = 'U', pswd = 'P', output='O', template='F',
-         no_color=False, no_gui=False, no_keyring=False, no_sheet=False,
-         reset=False, debug=False, version=False):
+def main(command = 'run', user = 'U', pswd = 'P', output='O', template='F',
+         profiles='N', no_color=False, no_gui=False, no_keyring=False,
+         no_sheet=False, reconcile=False, split=False, as_json=False,
+         profile=False, reset=False, debug=False, version=False, *terms):
     '''Generates a printable Word document containing recent hold requests and
 also update the relevant Google spreadsheet used for tracking requests.
 
@@ -146,10 +247,64 @@ any case.
 
 Hold It! will write the output to a file named "holds_print_list.docx" in the
 user's Desktop directory, unless the -o option (/o on Windows) is given with
-an explicit file path to use instead.
+an explicit file path to use instead.  The pages in the document are in
+shelf order, sorted by the call numbers of the items.
+
+The Hold It! configuration file (holdit.ini) can define several profiles,
+one for each circulation desk, each with its own spreadsheet, TIND location
+codes, template and output file.  In that case, Hold It! logs in to TIND and
+gets the hold data once, and then processes the profiles in parallel, except
+that profiles that use the same spreadsheet are processed one after another.
+Each profile's document is written to "holds_print_list_NAME.docx" on the
+Desktop unless the profile sets its own output file.  The -n option (/n on
+Windows) followed by a comma-separated list of profile names limits the run
+to those profiles.
+
+If given the -L option (/L on Windows), Hold It! writes a separate Word
+document for each library location of the items, instead of one document
+for all of them.  The location code is added to the name of each file.
+
+Hold It! normally only adds new hold requests to the spreadsheet.  If given
+the -r option (/r on Windows), it will also update the rows of existing
+requests whose values in TIND (such as the holds count, overdue notices,
+loan status or location) have changed since the rows were added.  Only the
+cells whose values changed are written.
+
+If given the -X option (/X on Windows), Hold It! profiles its run using
+the Python cProfile module.  When the run finishes, the profile data is
+written to a file named "profile-DATE-TIME.prof" in the Hold It! user data
+folder, and the functions that took the most time are printed.  The file
+can be examined further using Python's pstats module or tools such as
+snakeviz.
 
 If given the -V option (/V on Windows), this program will print version
 information and exit without doing anything else.
+
+Hold It! also accepts an optional command name as its first argument.  The
+default command is "run", which performs the actions described above.  The
+command "archive" instead performs sheet maintenance: it moves rows that are
+older than the number of days given by the "max_age_days" setting in the
+"[archive]" section of holdit.ini, and whose Caltech status is one of the
+values listed by "closed_statuses", out of the main tracking sheet and into
+per-year archive tabs in the same spreadsheet.  Hold It! remembers locally
+which hold requests were archived, so that they are not mistaken for new
+requests on subsequent runs.
+
+Hold It! keeps a local history of the hold requests it has seen in TIND and
+in the Google spreadsheet.  The command "search", followed by one or more
+words, searches this history without connecting to any network service and
+prints the matching requests.  Each word matches the beginning of words in
+the requester names, item titles, barcodes, call numbers and Caltech
+statuses.  If the -j option (/j on Windows) is also given, the results are
+printed in JSON format.
+
+The command "stats" summarizes the same local history: the distribution of
+the time taken to handle hold requests (from the request date until Hold It!
+saw the status change to one of the "closed_statuses" in the spreadsheet),
+the number and age of open requests at each location, and the number of
+requests handled by each staff member.  The results are printed, in JSON
+format if the -j option is given, or written to the file given with the -o
+option, in CSV format if the file name ends in ".csv" and JSON otherwise.
 '''
 
     # Our defaults are to do things like color the output, which means the
@@ -170,6 +325,10 @@ information and exit without doing anything else.
         template = None
     if output == 'O':
         output = None
+    if profiles == 'N':
+        profiles = None
+    else:
+        profiles = [name.strip() for name in profiles.split(',')]
 
     # Process the version argument first, because it causes an early exit.
     if version:
@@ -183,6 +342,18 @@ information and exit without doing anything else.
     if debug:
         set_debug(True)
 
+    # Searching and statistics only read the local history, so they need no
+    # GUI and no network access, and they do not need the worker thread.
+    if terms and command != 'search':
+        print('Unexpected arguments: {}'.format(' '.join(terms)))
+        sys.exit(1)
+    if command == 'search':
+        _search_history(terms, as_json)
+        sys.exit()
+    if command == 'stats':
+        _report_statistics(output, as_json)
+        sys.exit()
+
     # Switch between different ways of getting information from/to the user.
     if use_gui:
         controller = HoldItControlGUI()
@@ -197,20 +368,30 @@ information and exit without doing anything else.
 
     # Start the worker thread.
     if __debug__: log('Starting main body thread')
-    controller.start(MainBody(template, output, view_sheet, debug,
-                              controller, tracer, accesser, notifier))
+    controller.start(MainBody(command, template, output, profiles, split,
+                              view_sheet, reconcile, debug, profile, controller,
+                              tracer, accesser, notifier))
 
 
 class MainBody(Thread):
     '''Main body of Hold It! implemented as a Python thread.'''
 
-    def __init__(self, template, output, view_sheet, debug,
-                 controller, tracer, accesser, notifier):
+    def __init__(self, command, template, output, profile_names, split,
+                 view_sheet, reconcile, debug, profile, controller, tracer,
+                 accesser, notifier):
         '''Initializes main thread object but does not start the thread.'''
         Thread.__init__(self, name = "MainBody")
+        self._command    = command
         self._template   = template
         self._output     = output
+        self._profile_names = profile_names
+        self._split      = split
+        self._profile    = profile
+        self._profilers  = []
+        self._sheet_locks = {}
+        self._succeeded  = False
         self._view_sheet = view_sheet
+        self._reconcile  = reconcile
         self._debug      = debug
         self._controller = controller
         self._tracer     = tracer
@@ -223,9 +404,31 @@ class MainBody(Thread):
 
 
     def run(self):
+        start = time.perf_counter()
+        self._configure_exporter()
+        try:
+            if not self._profile:
+                self._run()
+                return
+            # Tasks run in worker threads are profiled by _profiled(), and
+            # their results are merged with this thread's.
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                self._run()
+            finally:
+                profiler.disable()
+                try:
+                    self._report_profile(profiler)
+                except Exception as err:
+                    # Don't hide the outcome of the run itself.
+                    if __debug__: log('unable to report profile: {}', str(err))
+        finally:
+            self._export_metrics(time.perf_counter() - start)
+
+
+    def _run(self):
         # Set shortcut variables for better code readability below.
-        template   = self._template
-        output     = self._output
         view_sheet = self._view_sheet
         debug      = self._debug
         controller = self._controller
@@ -236,77 +439,112 @@ class MainBody(Thread):
         # Preliminary sanity checks.  Do this here because we need the notifier
         # object to be initialized based on whether we're using GUI or CLI.
         tracer.start('Performing initial checks')
-        if not network_available():
-            notifier.fatal('No network connection.')
+        status = service_status(_COMMAND_HOSTS[self._command])
+        if not all(status.values()):
+            unreachable = [host for host, reachable in status.items() if not reachable]
+            details = 'Unable to reach {}'.format(', '.join(unreachable))
+            notifier.fatal('No network connection.', details)
+            tracer.stop('Stopping due to a problem connecting to services')
+            controller.stop()
+            return
 
         # Let's do this thing.
         try:
             config = Config(path.join(module_path(), "holdit.ini"))
+            configure_transport(**config.section('network'))
+            configure_tind(**config.section('tind'))
+            configure_enrichment(**config.section('enrichment'))
+            configure_logging(**config.section('logging'))
+            profiles = self._selected_profiles(config)
+            if not profiles:
+                tracer.stop('Stopping due to error')
+                controller.stop()
+                return
+            if self._command == 'archive':
+                self._archive(config, profiles)
+                self._succeeded = True
+                tracer.stop('Done')
+                controller.stop()
+                return
 
-            # The default template is expected to be inside the Hold It module.
-            # If the user supplies a template, we use it instead.
             tracer.update('Getting output template')
-            template_file = config.get('holdit', 'template')
-            template_file = path.abspath(path.join(module_path(), template_file))
-            if template:
-                temp = path.abspath(template)
-                if readable(temp):
-                    if __debug__: log('Using user-supplied template "{}"'.format(temp))
-                    template_file = temp
+            default_template = self._template_file(config.get('holdit', 'template'))
+            for profile in profiles:
+                if profile.template:
+                    profile.template = path.abspath(path.join(holdit_path(), profile.template))
                 else:
-                    notifier.warn('File "{}" not readable -- using default.'.format(template))
-            else:
-                # Check for "template.docx" in the Hold It installation dir.
-                temp = path.abspath(path.join(holdit_path(), "template.docx"))
-                if readable(temp):
-                    if __debug__: log('Using template found at "{}"'.format(temp))
-                    template_file = temp
+                    profile.template = default_template
 
             # Sanity check against possible screwups in creating the Hold It! app.
             # Do them here so that we can fail early if we know we can't finish.
-            if not readable(template_file):
-                notifier.fatal('Template doc file "{}" not readable.'.format(template_file))
-                sys.exit()
+            for profile in profiles:
+                if not readable(profile.template):
+                    notifier.fatal('Template doc file "{}" not readable.'.format(profile.template))
+                    sys.exit()
             if not writable(desktop_path()):
                 notifier.fatal('Output folder "{}" not writable.'.format(desktop_path()))
                 sys.exit()
 
-            # Get the data.
-            spreadsheet_id = config.get('holdit', 'spreadsheet_id')
+            # Get the data.  Getting the Google token can happen in parallel
+            # with the TIND login, if we already know the user name.
+            prefetch_credentials(accesser.user)
             tracer.update('Connecting to TIND')
-            tind_records = records_from_tind(accesser, notifier, tracer)
-            tracer.update('Connecting to Google')
-            google_records = records_from_google(spreadsheet_id, accesser.user, notifier)
-            missing_records = records_diff(google_records, tind_records)
-            new_records = list(filter(records_filter('all'), missing_records))
-            if __debug__: log('diff + filter => {} records'.format(len(new_records)))
-
-            if len(new_records) > 0:
-                # Update the spreadsheet with new records.
-                tracer.update('Updating Google spreadsheet')
-                update_google(spreadsheet_id, new_records, accesser.user, notifier)
-                # Write a printable report.
-                tracer.update('Generating printable document')
-                if not output:
-                    output = path.join(desktop_path(), "holds_print_list.docx")
-                if path.exists(output):
-                    rename_existing(output)
-                if file_in_use(output):
-                    details = '{} appears to be open in another program'.format(output)
-                    notifier.warn('Cannot write Word doc -- is it still open?', details)
-                else:
-                    result = printable_doc(new_records, template_file)
-                    result.save(output)
-                    tracer.update('Opening Word document for printing')
-                    open_file(output)
+            with timed('phase_seconds', phase = 'tind_login'):
+                tind_records = records_from_tind(accesser, notifier, tracer)
+
+            # Only holds that are on shelf or lost can be new, but all of
+            # them are needed to reconcile the rows already in the sheets.
+            if len(profiles) == 1:
+                if self._reconcile:
+                    # Reconciliation needs a second pass over the TIND records.
+                    with timed('phase_seconds', phase = 'tind_records'):
+                        tind_records = list(tind_records)
+                held_records = stage('status', on_shelf_or_lost(tind_records))
+                results = [self._process_profile(profiles[0], held_records,
+                                                 tind_records, True)]
             else:
+                # All profiles use the same TIND data, which we get only once.
+                # After that, the profiles are independent of each other.
+                with timed('phase_seconds', phase = 'tind_records'):
+                    tind_records = list(tind_records)
+                    held_records = list(stage('status', on_shelf_or_lost(tind_records)))
+                tracer.update('Processing {} profiles'.format(len(profiles)))
+                self._sheet_locks = {profile.spreadsheet_id: Lock() for profile in profiles}
+                with ThreadPoolExecutor(max_workers = len(profiles)) as executor:
+                    tasks = [executor.submit(self._profiled(self._process_profile_in_turn),
+                                             profile, held_records, tind_records, False)
+                             for profile in profiles]
+                # Failures are reported once, here, together.
+                results, failures = [], []
+                for profile, task in zip(profiles, tasks):
+                    err = task.exception()
+                    if err:
+                        failures.append('{}: {}'.format(profile.name, err))
+                        if not isinstance(err, (InternalError, ServiceFailure)):
+                            failures.append(''.join(traceback.format_exception(
+                                type(err), err, err.__traceback__)))
+                    else:
+                        results.append(task.result())
+                        tracer.update('Profile "{}": {} new hold requests'.format(
+                            profile.name, results[-1]))
+                if failures:
+                    notifier.fatal('Unable to process {} of {} profiles'.format(
+                        len(failures), len(profiles)), '\n'.join(failures))
+                    tracer.stop('Stopping due to error')
+                    controller.stop()
+                    return
+
+            if not any(results):
                 tracer.update('No new hold requests were found in TIND.')
-            # Open the spreadsheet too, if requested.
+            # Open the spreadsheets too, if requested.
+            sheets = sorted(set(profile.spreadsheet_id for profile in profiles))
             if isinstance(notifier, MessageHandlerGUI):
                 if notifier.yes_no('Open the tracking spreadsheet?'):
-                    open_google(spreadsheet_id)
+                    for spreadsheet_id in sheets:
+                        open_google(spreadsheet_id)
             elif view_sheet:
-                open_google(spreadsheet_id)
+                for spreadsheet_id in sheets:
+                    open_google(spreadsheet_id)
         except (KeyboardInterrupt, UserCancelled) as err:
             tracer.stop('Quitting.')
             controller.stop()
@@ -321,10 +559,342 @@ class MainBody(Thread):
                            str(err) + '\n' + traceback.format_exc())
             controller.stop()
         else:
+            self._succeeded = True
             tracer.stop('Done')
             controller.stop()
 
 
+    def _configure_exporter(self):
+        '''Reads the metrics export settings.  This is done before anything
+        else, so that runs that fail early still export their failure.'''
+        try:
+            config = Config(path.join(module_path(), "holdit.ini"))
+            configure_exporter(**config.section('metrics'))
+        except Exception as err:
+            if __debug__: log('unable to configure metrics export: {}', str(err))
+
+
+    def _export_metrics(self, run_seconds):
+        '''Writes the metrics of the run to the file set in the configuration
+        file, if any.  Failures are only logged, so as not to hide the
+        outcome of the run itself.'''
+        try:
+            export_metrics(self._succeeded, run_seconds)
+        except Exception as err:
+            if __debug__: log('unable to export metrics: {}', str(err))
+
+
+    def _profiled(self, function):
+        '''Returns 'function' itself if profiling is off.  Otherwise, returns
+        a function that calls 'function' under a profiler of its own, for
+        use in worker threads, which the profiler of the main body thread
+        does not see.'''
+        if not self._profile:
+            return function
+
+        def profiled_function(*args, **kwargs):
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Since Python 3.12, only one profiler can be active at a
+                # time, and the one in the main body thread sees all threads.
+                return function(*args, **kwargs)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profiler.disable()
+                self._profilers.append(profiler)
+
+        return profiled_function
+
+
+    def _report_profile(self, profiler):
+        '''Merges the data collected by 'profiler' and the worker thread
+        profilers, saves it and prints a summary.'''
+        stats = pstats.Stats(profiler, stream = sys.stdout)
+        for worker_profiler in self._profilers:
+            stats.add(worker_profiler)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        prof_file = path.join(user_data_path(), 'profile-{}.prof'.format(stamp))
+        stats.dump_stats(prof_file)
+        print('Profile data written to {}'.format(prof_file))
+        stats.sort_stats('cumulative').print_stats(_PROFILE_TOP)
+
+
+    def _process_profile_in_turn(self, profile, *args):
+        '''Calls _process_profile() once no other profile that uses the same
+        spreadsheet is being processed.  Otherwise, profiles that share a
+        spreadsheet and whose locations overlap would each find the same new
+        hold requests, and both would add them to the spreadsheet.'''
+        with self._sheet_locks[profile.spreadsheet_id]:
+            return self._process_profile(profile, *args)
+
+
+    def _process_profile(self, profile, held_records, tind_records, show_progress):
+        '''Finds the hold requests in 'held_records' (the TIND records of
+        items on shelf or lost) that are new for the given profile, adds them
+        to the profile's spreadsheet and writes the printable document for
+        them.  If reconciliation is on, the existing rows are updated from
+        'tind_records', which has all the TIND records regardless of status
+        and must then be a list.  If 'show_progress' is False, progress
+        messages only go to the debug log.  Returns the number of new
+        records.  If updating the spreadsheet or writing the document fails,
+        the exception is raised again once both have finished, for the
+        caller to report.  (If both fail, the second failure is reported
+        here.)'''
+        user     = self._accesser.user
+        notifier = self._notifier
+
+        def progress(message):
+            if show_progress:
+                self._tracer.update(message)
+            elif __debug__:
+                log('profile {}: {}', profile.name, message)
+
+        progress('Connecting to Google')
+        with timed('phase_seconds', phase = 'google_read', profile = profile.name):
+            google_records = records_from_google(profile.spreadsheet_id, user, notifier)
+            known_records = records_index(stage('google', google_records,
+                                                profile = profile.name))
+        archived = ArchiveIndex(profile.spreadsheet_id)
+
+        # The records flow through the filter and the diff one at a time.
+        # Only the new records, which are usually few, are kept.
+        if profile.locations:
+            test = records_filter('location', profile.locations)
+        else:
+            test = records_filter('all')
+        wanted = stage('filter', filter(test, held_records), profile = profile.name)
+        missing = stage('diff', records_diff(known_records, wanted, archived),
+                        profile = profile.name)
+        # This is where the TIND data is requested, read and parsed, unless
+        # that was already done for reconciliation or multiple profiles.  It
+        # happens after the spreadsheet has been read, so that the response
+        # from TIND is read as soon as it arrives.
+        with timed('phase_seconds', phase = 'tind_records', profile = profile.name):
+            new_records = list(missing)
+        if __debug__: log('diff + filter => {} records', len(new_records))
+
+        if self._reconcile:
+            progress('Updating changed rows in Google spreadsheet')
+            reconcile_google(profile.spreadsheet_id, tind_records, known_records,
+                             user, notifier)
+
+        # The local history is updated last, because nothing else needs it.
+        if not new_records:
+            self._update_history(known_records.values())
+            return 0
+        if enrichment_enabled():
+            progress('Getting details of new hold requests from TIND')
+            with timed('phase_seconds', phase = 'enrich', profile = profile.name):
+                enrich_records(new_records, tind_session())
+
+        # Updating the spreadsheet is network-bound and writing the printable
+        # report is CPU-bound, and neither needs the other, so we do both at
+        # the same time.  Leaving the "with" block waits for both to finish.
+        # A failure in one doesn't stop the other; failures are reported
+        # after both are done.  The spreadsheet gets the records in request
+        # order and the printed pages are in shelf order.
+        progress('Updating Google spreadsheet and generating document')
+        output = self._output_file(profile, show_progress)
+        with timed('phase_seconds', phase = 'output', profile = profile.name), \
+             ThreadPoolExecutor(max_workers = 2) as executor:
+            sheet = executor.submit(self._profiled(update_google), profile.spreadsheet_id,
+                                    new_records, user, notifier)
+            doc = executor.submit(self._profiled(self._write_document),
+                                  sorted(new_records, key = shelf_order),
+                                  profile.template, output)
+        if sheet.exception():
+            # Our caller reports the failure that is raised.
+            self._report_failure(doc, 'generate the printable document')
+            raise sheet.exception()
+        if doc.exception():
+            raise doc.exception()
+        for document in doc.result():
+            progress('Opening Word document for printing')
+            open_file(document)
+        self._update_history(chain(known_records.values(), new_records))
+        return len(new_records)
+
+
+    def _selected_profiles(self, config):
+        '''Returns the profiles from the configuration that were selected on
+        the command line, or all of them if none were selected.  Returns
+        None if a selected profile does not exist.'''
+        profiles = config.profiles()
+        if not self._profile_names:
+            return profiles
+        known = [profile.name for profile in profiles]
+        unknown = [name for name in self._profile_names if name not in known]
+        if unknown:
+            details = 'Profiles in configuration file: {}'.format(', '.join(known))
+            self._notifier.fatal('Unknown profile "{}"'.format(unknown[0]), details)
+            return None
+        return [profile for profile in profiles if profile.name in self._profile_names]
+
+
+    def _template_file(self, configured_template):
+        '''Returns the path of the template to use when no profile-specific
+        template is given.  'configured_template' is the value of "template"
+        in the configuration file, relative to the Hold It! module dir.'''
+        # The default template is expected to be inside the Hold It module.
+        # If the user supplies a template, we use it instead.
+        template_file = path.abspath(path.join(module_path(), configured_template))
+        if self._template:
+            temp = path.abspath(self._template)
+            if readable(temp):
+                if __debug__: log('Using user-supplied template "{}"'.format(temp))
+                template_file = temp
+            else:
+                self._notifier.warn('File "{}" not readable -- using default.'.format(self._template))
+        else:
+            # Check for "template.docx" in the Hold It installation dir.
+            temp = path.abspath(path.join(holdit_path(), "template.docx"))
+            if readable(temp):
+                if __debug__: log('Using template found at "{}"'.format(temp))
+                template_file = temp
+        return template_file
+
+
+    def _output_file(self, profile, single):
+        '''Returns the path of the document to write for 'profile'.  The -o
+        command-line option only applies when a single profile is used.'''
+        if profile.output:
+            return profile.output
+        if single and self._output:
+            return self._output
+        if single:
+            return path.join(desktop_path(), "holds_print_list.docx")
+        return path.join(desktop_path(), "holds_print_list_{}.docx".format(profile.name))
+
+
+    def _report_failure(self, task, what):
+        '''Reports the exception raised by the concurrent.futures.Future
+        object 'task', if any, unless it is one of our own exceptions (which
+        are always reported before they are raised).  This does not stop the
+        run; callers must still act on the failure.'''
+        err = task.exception()
+        if err and not isinstance(err, (InternalError, ServiceFailure)):
+            details = ''.join(traceback.format_exception(type(err), err,
+                                                         err.__traceback__))
+            self._notifier.error('Unable to ' + what, details)
+
+
+    def _write_document(self, records, template_file, output):
+        '''Writes the printable document for 'records' to the file 'output'.
+        If the -L option was given, writes a separate document for each
+        location instead, with the location code added to the file name, and
+        with the records in each document sorted in shelf order.  The
+        documents are generated in parallel.  Returns the list of files
+        written.'''
+        if not self._split:
+            return [output] if self._write_one_document(records, template_file, output) else []
+        groups = records_by_location(records)
+        base, ext = path.splitext(output)
+        outputs = {location: '{}_{}{}'.format(base, re.sub(r'[^\w-]', '_', location), ext)
+                   for location in groups}
+        with ThreadPoolExecutor(max_workers = len(groups)) as executor:
+            tasks = {location: executor.submit(self._profiled(self._write_one_document), group,
+                                               template_file, outputs[location])
+                     for location, group in groups.items()}
+        return [outputs[location] for location, task in sorted(tasks.items())
+                if task.result()]
+
+
+    def _write_one_document(self, records, template_file, output):
+        '''Writes the printable document for 'records' to the file 'output'.
+        Returns True if the file was written.'''
+        if path.exists(output):
+            rename_existing(output)
+        if file_in_use(output):
+            details = '{} appears to be open in another program'.format(output)
+            self._notifier.warn('Cannot write Word doc -- is it still open?', details)
+            return False
+        result = printable_doc(records, template_file)
+        result.save(output)
+        return True
+
+
+    def _update_history(self, records):
+        '''Adds 'records' to the local history of hold requests used by the
+        "search" and "stats" commands.  Only records that are new or have
+        changed are written.  Failures are reported but are not fatal.'''
+        try:
+            history = HoldHistory()
+            history.add(records)
+            history.close()
+        except sqlite3.Error as err:
+            self._notifier.warn('Unable to update the local hold history', str(err))
+
+
+    def _archive(self, config, profiles):
+        '''Moves old, closed hold requests out of the main tracking sheets.'''
+        configure_archive(**config.section('archive'))
+        user = self._accesser.user
+        if not user:
+            user, _, cancelled = self._accesser.name_and_password()
+            if cancelled:
+                raise UserCancelled
+        selector = archive_selector()
+        for spreadsheet_id in sorted(set(p.spreadsheet_id for p in profiles)):
+            self._tracer.update('Archiving old rows in Google spreadsheet')
+            moved = archive_google(spreadsheet_id, user, self._notifier, selector)
+            ArchiveIndex(spreadsheet_id).add(moved)
+            self._tracer.update('Archived {} rows'.format(len(moved)))
+
+
+def _search_history(terms, as_json):
+    '''Prints the hold requests in the local history that match 'terms'.'''
+    history = HoldHistory()
+    results = history.search(terms)
+    history.close()
+    if as_json:
+        print(json.dumps(results, indent = 2))
+    elif not results:
+        print('No matching hold requests found.')
+    else:
+        for result in results:
+            print('{date_requested}  {item_barcode}  {requester_name}\n'
+                  '    {item_title}\n'
+                  '    {item_call_number}  {item_location_code}  status: {caltech_status}\n'
+                  .format(**{k: v or '' for k, v in result.items()}))
+
+
+def _report_statistics(output, as_json):
+    '''Prints or writes statistics about the hold requests in the local
+    history.'''
+    # Imported here so that only this command needs NumPy.
+    from holdit.analytics import hold_statistics, write_csv
+    config = Config(path.join(module_path(), "holdit.ini"))
+    configure_archive(**config.section('archive'))
+    history = HoldHistory()
+    statistics = hold_statistics(history.rows(), closed_statuses())
+    history.close()
+    if output:
+        if output.lower().endswith('.csv'):
+            write_csv(statistics, output)
+        else:
+            with open(output, 'w', encoding = 'utf-8') as f:
+                json.dump(statistics, f, indent = 2)
+        print('Statistics written to {}'.format(output))
+    elif as_json:
+        print(json.dumps(statistics, indent = 2))
+    else:
+        print('Requests: {requests} ({open} open, {closed} closed)'.format(**statistics))
+        turnaround = statistics['turnaround_days']
+        if turnaround['count']:
+            print('Turnaround (days): median {p50}, 90th percentile {p90}, maximum {max}'
+                  .format(**turnaround))
+        print('Open requests by location:')
+        for entry in statistics['backlog']:
+            print('    {:<10} {:>6}'.format(entry['location'], entry['open']))
+        print('Requests handled by staff member:')
+        for entry in statistics['staff']:
+            print('    {:<10} {:>6}  (median {} days)'.format(
+                entry['initials'], entry['closed'], entry['median_turnaround_days']))
+
+
 # On windows, we want the command-line args to use slash intead of hyphen.
 
 if sys.platform.startswith('win'):
@@ -336,6 +906,9 @@ if sys.platform.startswith('win'):
 # The following allows users to invoke this using "python3 -m holdit".
 
 if __name__ == '__main__':
+    # Needed for the process pool used for parsing when Hold It! has been
+    # packaged as a frozen Windows executable.
+    multiprocessing.freeze_support()
     plac.call(main)
 
 
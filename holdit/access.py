@@ -74,6 +74,10 @@ class AccessHandlerCLI(AccessHandlerBase):
         super().__init__(user, pswd)
         self._use_keyring = use_keyring
         self._reset = reset_keyring
+        # Knowing the user name before logging in lets the Google token be
+        # fetched at the same time as the TIND login.
+        if not user and use_keyring and not reset_keyring:
+            self._user, _, _, _ = keyring_credentials(_KEYRING)
 
 
     def name_and_password(self):
@@ -0,0 +1,187 @@
+'''
+analytics.py: summary statistics about hold request processing
+
+The functions in this module summarize the hold requests recorded in the
+local history (see history.py): how long requests take to be handled, how
+many requests are still open at each location, and how many requests each
+staff member has handled.  The values are loaded once into NumPy arrays and
+all the calculations are done on whole arrays, so that summarizing even
+hundreds of thousands of requests takes well under a second.
+
+A request counts as handled ("closed") when its Caltech status in the
+spreadsheet is one of the closed statuses given in the configuration file.
+Its turnaround time is the time between the request date and the time
+Hold It! saw the status change to its current value.  Requests that already
+had their status when Hold It! first saw them have no turnaround time.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import csv
+from   datetime import datetime
+import numpy as np
+
+import holdit
+from holdit.dates import parsed_datetime
+from holdit.debug import log
+
+
+# Global constants.
+# .............................................................................
+
+_PERCENTILES = [50, 75, 90, 95]
+
+_HISTOGRAM_EDGES = [0, 1, 2, 3, 5, 7, 14, 30, np.inf]
+'''
+Boundaries (in days) of the bins of the turnaround time histogram.
+'''
+
+_ONE_DAY = np.timedelta64(1, 'D')
+
+
+# Exported functions.
+# .............................................................................
+
+def hold_statistics(rows, closed_statuses, now = None):
+    '''Summarizes the hold requests in 'rows', an iterable of dictionaries
+    such as those produced by HoldHistory.rows().  'closed_statuses' is a
+    list of the Caltech status values (compared without regard to case)
+    that mean a request has been handled.  Returns a dictionary.'''
+    columns = _columns(rows)
+    now = np.datetime64(now or datetime.now(), 's')
+    closed_values = [status.strip().lower() for status in closed_statuses]
+    closed = np.isin(columns['status'], closed_values)
+    open_ = ~closed
+    requested_known = ~np.isnat(columns['requested'])
+
+    turnaround = (columns['status_seen'] - columns['requested']) / _ONE_DAY
+    handled = closed & requested_known & ~np.isnat(columns['status_seen']) & (turnaround >= 0)
+    age = (now - columns['requested']) / _ONE_DAY
+
+    if __debug__: log('statistics over {} requests ({} closed)',
+                      len(closed), np.count_nonzero(closed))
+    return {
+        'requests'        : int(len(closed)),
+        'open'            : int(np.count_nonzero(open_)),
+        'closed'          : int(np.count_nonzero(closed)),
+        'turnaround_days' : _distribution(turnaround[handled]),
+        'backlog'         : _backlog(columns['location'][open_ & requested_known],
+                                     age[open_ & requested_known],
+                                     np.count_nonzero(open_ & ~requested_known)),
+        'staff'           : _throughput(columns['staff'][handled], turnaround[handled]),
+    }
+
+
+def write_csv(statistics, file):
+    '''Writes the result of hold_statistics() to the named file as CSV, in
+    long form: one row for each value, with the columns "section", "group",
+    "measure" and "value".'''
+    with open(file, 'w', newline = '', encoding = 'utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['section', 'group', 'measure', 'value'])
+        for measure in ['requests', 'open', 'closed']:
+            writer.writerow(['summary', '', measure, statistics[measure]])
+        for measure, value in statistics['turnaround_days'].items():
+            if measure == 'histogram':
+                for bin in value:
+                    writer.writerow(['turnaround_histogram', bin['days'], 'count', bin['count']])
+            else:
+                writer.writerow(['turnaround_days', '', measure, value])
+        for entry in statistics['backlog']:
+            for measure, value in entry.items():
+                if measure != 'location':
+                    writer.writerow(['backlog', entry['location'], measure, value])
+        for entry in statistics['staff']:
+            for measure, value in entry.items():
+                if measure != 'initials':
+                    writer.writerow(['staff', entry['initials'], measure, value])
+
+
+# Miscellaneous utilities.
+# .............................................................................
+
+def _columns(rows):
+    # Turn the rows into one array per field.  This is the only part that
+    # loops over individual requests.
+    requested, status_seen, status, location, staff = [], [], [], [], []
+    for row in rows:
+        requested.append(row['date_requested'] or '')
+        status_seen.append(row['status_seen'] or '')
+        status.append((row['caltech_status'] or '').strip().lower())
+        location.append((row['item_location_code'] or '').strip() or 'unknown')
+        staff.append((row['caltech_staff_initials'] or '').strip().upper() or 'unknown')
+    return {'requested'   : _datetimes(requested),
+            'status_seen' : _datetimes(status_seen),
+            'status'      : np.array(status, dtype = str),
+            'location'    : np.array(location, dtype = str),
+            'staff'       : np.array(staff, dtype = str)}
+
+
+def _datetimes(texts):
+    # The history stores dates in ISO format, which NumPy can convert in one
+    # go.  Dates that could not be interpreted when they were stored are
+    # left as they were found, and then we have to go one at a time.
+    try:
+        return np.array([text or 'NaT' for text in texts], dtype = 'datetime64[s]')
+    except ValueError:
+        return np.array([parsed_datetime(text) for text in texts],
+                        dtype = 'datetime64[s]')
+
+
+def _distribution(days):
+    if len(days) == 0:
+        return {'count': 0}
+    result = {'count': int(len(days)), 'mean': _rounded(days.mean()),
+              'max': _rounded(days.max())}
+    for percentile, value in zip(_PERCENTILES, np.percentile(days, _PERCENTILES)):
+        result['p{}'.format(percentile)] = _rounded(value)
+    counts, _ = np.histogram(days, bins = _HISTOGRAM_EDGES)
+    result['histogram'] = [{'days': _bin_label(low, high), 'count': int(count)}
+                           for low, high, count in zip(_HISTOGRAM_EDGES,
+                                                       _HISTOGRAM_EDGES[1:], counts)]
+    return result
+
+
+def _backlog(locations, ages, undated):
+    groups, inverse, counts = np.unique(locations, return_inverse = True,
+                                        return_counts = True)
+    oldest = np.full(len(groups), -np.inf)
+    np.maximum.at(oldest, inverse, ages)
+    result = []
+    for index, location in enumerate(groups):
+        result.append({'location': str(location), 'open': int(counts[index]),
+                       'median_age_days': _rounded(np.median(ages[inverse == index])),
+                       'oldest_age_days': _rounded(oldest[index])})
+    if undated:
+        result.append({'location': 'undated', 'open': int(undated)})
+    return sorted(result, key = lambda entry: entry['open'], reverse = True)
+
+
+def _throughput(staff, days):
+    groups, inverse, counts = np.unique(staff, return_inverse = True,
+                                        return_counts = True)
+    totals = np.bincount(inverse, weights = days, minlength = len(groups))
+    result = []
+    for index, initials in enumerate(groups):
+        result.append({'initials': str(initials), 'closed': int(counts[index]),
+                       'mean_turnaround_days': _rounded(totals[index] / counts[index]),
+                       'median_turnaround_days': _rounded(np.median(days[inverse == index]))})
+    return sorted(result, key = lambda entry: entry['closed'], reverse = True)
+
+
+def _bin_label(low, high):
+    return '{}+'.format(low) if np.isinf(high) else '{}-{}'.format(low, high)
+
+
+def _rounded(value):
+    return round(float(value), 2)
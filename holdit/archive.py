@@ -0,0 +1,153 @@
+'''
+archive.py: moving old hold requests out of the main tracking sheet
+
+The tracking spreadsheet grows with every hold request ever recorded, and
+Hold It! reads the whole first sheet on every run.  The code in this module
+moves rows that are both old and closed (according to the staff-maintained
+status column) into per-year archive tabs in the same spreadsheet, and keeps
+a small local index of the requests that were moved.  The index lets
+records_diff() recognize archived requests without having to read the
+archive tabs back from Google.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+from   collections import namedtuple
+from   datetime import datetime, timedelta
+from   os import path
+
+import holdit
+from holdit.dates import parsed_datetime
+from holdit.records import request_key
+from holdit.files import user_data_path
+from holdit.debug import log
+
+
+# Global constants.
+# .............................................................................
+
+_ARCHIVE_TAB = 'Archive {}'
+'''
+Format of the titles of the archive tabs.  The argument is the year.
+'''
+
+_INDEX_FILE = 'archived-{}.tsv'
+'''
+Name of the local index file of archived requests.  The argument is the
+spreadsheet identifier, so that different spreadsheets have separate indexes.
+'''
+
+
+# Global variables.
+# .............................................................................
+
+_settings = {
+    'max_age_days'    : 365,        # Age beyond which closed rows are moved.
+    'closed_statuses' : 'done, filled, picked up, cancelled, canceled',
+}
+'''
+Archiving settings.  These can be changed using configure().
+'''
+
+
+# Class definitions.
+# .............................................................................
+
+_ArchivedRequest = namedtuple('_ArchivedRequest',
+                              'item_barcode date_requested requester_name')
+
+class ArchiveIndex():
+    '''Set-like collection of the keys of hold requests that have been moved
+    out of the main sheet of a given spreadsheet.  The index is stored in a
+    tab-separated file in the user's data directory, with one line per
+    request holding only the fields needed to compute request keys.'''
+
+    def __init__(self, gs_id):
+        self._file = path.join(user_data_path(), _INDEX_FILE.format(gs_id))
+        self._keys = set()
+        if path.exists(self._file):
+            if __debug__: log('reading archive index {}', self._file)
+            with open(self._file, 'r', encoding = 'utf-8') as f:
+                for line in f:
+                    fields = line.rstrip('\n').split('\t')
+                    if len(fields) == 3:
+                        self._keys.add(request_key(_ArchivedRequest(*fields)))
+            if __debug__: log('archive index has {} entries', len(self._keys))
+
+
+    def __contains__(self, key):
+        return key in self._keys
+
+
+    def __len__(self):
+        return len(self._keys)
+
+
+    def add(self, records):
+        '''Adds the given records to the index and saves them to disk.'''
+        with open(self._file, 'a', encoding = 'utf-8') as f:
+            for record in records:
+                fields = [_clean(record.item_barcode), _clean(record.date_requested),
+                          _clean(record.requester_name)]
+                f.write('\t'.join(fields) + '\n')
+                self._keys.add(request_key(_ArchivedRequest(*fields)))
+        if __debug__: log('archive index now has {} entries', len(self._keys))
+
+
+# Exported functions.
+# .............................................................................
+
+def configure(**settings):
+    '''Changes the archiving settings.  Recognized keyword arguments are
+    max_age_days and closed_statuses (a comma-separated list).'''
+    for name, value in settings.items():
+        if name not in _settings:
+            raise ValueError('Unrecognized archive setting "{}"'.format(name))
+        if value is not None:
+            _settings[name] = type(_settings[name])(value)
+    if __debug__: log('archive settings: {}', _settings)
+
+
+def closed_statuses():
+    '''Returns the list of Caltech status values that mean that a hold
+    request has been handled.'''
+    return [status.strip() for status in _settings['closed_statuses'].split(',')
+            if status.strip()]
+
+
+def archive_selector():
+    '''Returns a function suitable for google_sheet.archive_google().  The
+    function returns the name of a yearly archive tab for records whose
+    request date is more than max_age_days old and whose Caltech status is
+    one of closed_statuses() (compared without regard to case), and None
+    for all other records.'''
+    cutoff = datetime.now() - timedelta(days = _settings['max_age_days'])
+    closed = set(status.lower() for status in closed_statuses())
+
+    def archive_tab(record):
+        if record.caltech_status.strip().lower() not in closed:
+            return None
+        requested = parsed_datetime(record.date_requested)
+        if requested is None or requested >= cutoff:
+            return None
+        return _ARCHIVE_TAB.format(requested.year)
+
+    return archive_tab
+
+
+# Miscellaneous utilities.
+# .............................................................................
+
+def _clean(value):
+    # Keep the index file format simple by not allowing separators in values.
+    return value.replace('\t', ' ').replace('\n', ' ')
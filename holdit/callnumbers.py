@@ -0,0 +1,93 @@
+'''
+callnumbers.py: sort keys for library call numbers
+
+Call numbers do not sort correctly as plain strings: "QA76.9" must come
+before "QA76.45" only if the class numbers are read as whole numbers and the
+decimals as fractions, "QA9" must come before "QA76", and so on.  The
+function sort_key() in this module turns a call number into a string that
+does sort in shelf order when compared with the keys of other call numbers.
+Library of Congress call numbers are recognized first, then Dewey decimal
+call numbers; anything else (local schemes, accession numbers) is compared
+piecewise, with runs of digits compared as numbers.
+
+Keys are cached, so computing the key of a call number that has been seen
+before costs only a dictionary lookup.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+from   functools import lru_cache
+import re
+
+import holdit
+
+
+# Global constants.
+# .............................................................................
+
+_CACHE_SIZE = 65536
+'''
+Maximum number of call numbers whose sort keys are kept in memory.
+'''
+
+_LC_REGEX = re.compile(r'''^([A-Z]{1,3})\s*            # Class letters.
+                            (\d{1,5})(?:\.(\d+))?\s*   # Class number.
+                            ((?:\.?\s*[A-Z]\d+\s*)*)   # Cutters.
+                            (.*)$                      # Dates, volumes, etc.
+                        ''', re.VERBOSE)
+
+_DEWEY_REGEX = re.compile(r'^(\d{3})(?:\.(\d+))?\s*(.*)$')
+
+_CUTTER_REGEX = re.compile(r'([A-Z])(\d+)')
+
+_PART_REGEX = re.compile(r'\d+|[A-Z]+')
+
+# The key of each kind of call number starts with a different character, so
+# that the kinds sort in this order: LC, Dewey, other, and finally empty.
+_LC_PREFIX    = '1'
+_DEWEY_PREFIX = '2'
+_OTHER_PREFIX = '3'
+_EMPTY_KEY    = '9'
+
+
+# Exported functions.
+# .............................................................................
+
+@lru_cache(maxsize = _CACHE_SIZE)
+def sort_key(call_number):
+    '''Returns a string that can be compared with the keys of other call
+    numbers to put them in shelf order.'''
+    text = ' '.join(call_number.upper().split())
+    if not text:
+        return _EMPTY_KEY
+    match = _LC_REGEX.match(text)
+    if match:
+        letters, whole, fraction, cutters, rest = match.groups()
+        key = [_LC_PREFIX, letters.ljust(3), whole.zfill(5), fraction or '']
+        for letter, digits in _CUTTER_REGEX.findall(cutters):
+            key.append(letter + digits)
+        return ' '.join(key) + ' ' + _parts_key(rest)
+    match = _DEWEY_REGEX.match(text)
+    if match:
+        whole, fraction, rest = match.groups()
+        return ' '.join([_DEWEY_PREFIX, whole, fraction or '', _parts_key(rest)])
+    return _OTHER_PREFIX + ' ' + _parts_key(text)
+
+
+# Miscellaneous utilities.
+# .............................................................................
+
+def _parts_key(text):
+    # Runs of digits are padded so that "v.9" sorts before "v.10".
+    return ' '.join(part.zfill(8) if part.isdigit() else part
+                    for part in _PART_REGEX.findall(text))
@@ -25,9 +25,33 @@ from holdit.files import module_path
 from holdit.debug import log
 
 
+# Global constants.
+# .............................................................................
+
+_PROFILE_PREFIX = 'profile '
+'''
+Prefix of the names of configuration file sections that define profiles.
+'''
+
+
 # Class definitions.
 # .............................................................................
 
+class Profile():
+    '''Settings for one circulation desk: the spreadsheet used to track its
+    holds, the TIND location codes of the holds it handles (None meaning
+    all locations), and the template and output file for its printable
+    document (None meaning the defaults).'''
+
+    def __init__(self, name, spreadsheet_id, locations = None, template = None,
+                 output = None):
+        self.name           = name
+        self.spreadsheet_id = spreadsheet_id
+        self.locations      = locations
+        self.template       = template
+        self.output         = output
+
+
 class Config():
     '''A class to encapsulate reading our configuration file.'''
 
@@ -76,3 +100,35 @@ class Config():
                 return self._cfg.items(section_name)
             else:
                 return None
+
+
+    def section(self, section):
+        '''Returns a dictionary of the settings in the named section.  The
+        dictionary is empty if the file has no such section, so that the
+        code using the settings keeps its defaults.'''
+        if not self._cfg or not self._cfg.has_section(section):
+            return {}
+        return dict(self._cfg.items(section))
+
+
+    def profiles(self):
+        '''Returns a list of Profile objects, one for each section of the
+        configuration file named "profile NAME".  Values missing from a
+        profile section are taken from the "holdit" section.  If there are
+        no profile sections, the list contains a single profile named
+        "holdit" built from the "holdit" section.
+        '''
+        default_id = self._cfg.get('holdit', 'spreadsheet_id')
+        sections = [s for s in self._cfg.sections() if s.startswith(_PROFILE_PREFIX)]
+        if not sections:
+            return [Profile('holdit', default_id)]
+        profiles = []
+        for section in sections:
+            value = lambda prop: self._cfg.get(section, prop, fallback = None)
+            locations = value('locations')
+            if locations:
+                locations = [loc.strip() for loc in locations.split(',') if loc.strip()]
+            profiles.append(Profile(section[len(_PROFILE_PREFIX):].strip(),
+                                    value('spreadsheet_id') or default_id,
+                                    locations, value('template'), value('output')))
+        return profiles
@@ -17,11 +17,30 @@ file "LICENSE" for more information.
 import getpass
 import keyring
 import sys
+import threading
 
 if sys.platform.startswith('win'):
     import keyring.backends
     from keyring.backends.Windows import WinVaultKeyring
 
+from holdit.debug import log
+
+
+# Global variables.
+# .............................................................................
+
+_cache = {}
+'''
+Values obtained from the keyring during this process, keyed by tuples of
+(service, user).  Keyring calls can be slow (hundreds of milliseconds on
+some systems) and can even cause the operating system to prompt the user,
+so we look up each value at most once per process.
+'''
+
+_cache_lock = threading.Lock()
+
+_keyring_initialized = False
+
 
 # Credentials/keyring functions
 # .............................................................................
@@ -84,9 +103,7 @@ def keyring_credentials(service, user=None):
     service with a different user login name than the user's current login
     name without having to ask the user for the alternative name every time.
     '''
-    if sys.platform.startswith('win'):
-        keyring.set_keyring(WinVaultKeyring())
-    value = keyring.get_password(service, user if user else 'credentials')
+    value = cached_password(service, user if user else 'credentials')
     return _decoded(value) if value else (None, None, None, None)
 
 
@@ -96,9 +113,52 @@ def save_keyring_credentials(service, user, pswd, host=None, port=None):
     pswd = pswd if pswd else ''
     host = host if host else ''
     port = port if port else ''
-    if sys.platform.startswith('win'):
-        keyring.set_keyring(WinVaultKeyring())
-    keyring.set_password(service, 'credentials', _encoded(user, pswd, host, port))
+    set_cached_password(service, 'credentials', _encoded(user, pswd, host, port))
+
+
+def cached_password(service, user):
+    '''Returns the value of keyring.get_password(service, user), asking the
+    keyring only the first time the value is requested in this process.'''
+    with _cache_lock:
+        if (service, user) not in _cache:
+            _init_keyring()
+            if __debug__: log('looking up keyring value for {}', service)
+            _cache[(service, user)] = keyring.get_password(service, user)
+        return _cache[(service, user)]
+
+
+def set_cached_password(service, user, value):
+    '''Stores 'value' in the keyring and in our cache of keyring values.'''
+    with _cache_lock:
+        _init_keyring()
+        keyring.set_password(service, user, value)
+        _cache[(service, user)] = value
+
+
+def delete_cached_password(service, user):
+    '''Deletes the value from the keyring and from our cache.'''
+    with _cache_lock:
+        _init_keyring()
+        _cache.pop((service, user), None)
+        keyring.delete_password(service, user)
+
+
+def forget_cached_credentials(service = None):
+    '''Discards cached keyring values for 'service', or all cached values if
+    'service' is None, so that they are fetched again the next time they are
+    needed.  This does not change the contents of the keyring.'''
+    with _cache_lock:
+        if __debug__: log('forgetting cached keyring values')
+        for key in [key for key in _cache if service in (None, key[0])]:
+            del _cache[key]
+
+
+def _init_keyring():
+    global _keyring_initialized
+    if not _keyring_initialized:
+        if sys.platform.startswith('win'):
+            keyring.set_keyring(WinVaultKeyring())
+        _keyring_initialized = True
 
 
 _sep = ''
@@ -0,0 +1,111 @@
+'''
+dates.py: interpreting the dates found in TIND and the Google spreadsheet
+
+TIND and Google Sheets do not always write the same date the same way (for
+example, "2018-07-23 10:34:00" in TIND may come back from the spreadsheet as
+"7/23/2018 10:34:00").  The function parsed_datetime() in this module turns
+any of the formats seen in practice into a Python datetime object.
+
+Parsing dates with strptime() is slow, and trying a list of formats one
+after the other is slower still.  Two things keep the cost down: the
+results are cached per string, and the format that worked for a string is
+remembered for all other strings of the same shape (the same sequence of
+digits and separators), so that usually only one format is ever tried.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+from   datetime import datetime
+from   functools import lru_cache
+import re
+
+import holdit
+from holdit.debug import log
+
+
+# Global constants.
+# .............................................................................
+
+_DATE_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d',
+                 '%Y-%m-%dT%H:%M:%S', '%m/%d/%Y %H:%M:%S', '%m/%d/%Y %H:%M',
+                 '%m/%d/%Y', '%d %b %Y', '%b %d, %Y']
+'''
+Date formats tried when interpreting dates, in order of preference.  TIND
+and the spreadsheet write dates in US order, so day-first numeric formats
+are deliberately absent: no two formats here can both accept a string of the
+same shape with different results, which is what makes it safe to remember
+one format per shape.
+'''
+
+_CACHE_SIZE = 65536
+'''
+Maximum number of date strings whose parsed values are kept in memory.
+'''
+
+_DIGITS_REGEX = re.compile(r'\d')
+
+
+# Global variables.
+# .............................................................................
+
+_shape_formats = {}
+'''
+Dictionary mapping the shapes of date strings (see _shape()) to the format
+that was found to work for strings of that shape.
+'''
+
+
+# Exported functions.
+# .............................................................................
+
+@lru_cache(maxsize = _CACHE_SIZE)
+def parsed_datetime(text):
+    '''Returns the datetime object for the date (and possibly time) in the
+    string 'text', or None if 'text' is empty or in an unrecognized format.'''
+    text = text.strip()
+    if not text:
+        return None
+    shape = _shape(text)
+    known_format = _shape_formats.get(shape)
+    if known_format:
+        try:
+            return datetime.strptime(text, known_format)
+        except ValueError:
+            pass
+    for date_format in _DATE_FORMATS:
+        if date_format == known_format:
+            continue
+        try:
+            value = datetime.strptime(text, date_format)
+        except ValueError:
+            continue
+        _shape_formats[shape] = date_format
+        return value
+    if __debug__: log('cannot interpret date "{}"', text)
+    return None
+
+
+def date_key(text):
+    '''Returns a value for comparing the date in 'text' with other dates: the
+    parsed datetime if the date can be interpreted, otherwise the string
+    itself with surrounding whitespace removed.'''
+    return parsed_datetime(text) or text.strip()
+
+
+# Miscellaneous utilities.
+# .............................................................................
+
+def _shape(text):
+    # Strings that differ only in their digits can be parsed the same way.
+    # (Month names are left in, so "Jul" and "July" have different shapes.)
+    return _DIGITS_REGEX.sub('9', text)
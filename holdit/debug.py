@@ -1,6 +1,18 @@
 '''
 debug.py: debugging aids for Hold It!
 
+Messages are logged using log(), which takes a format string, the arguments
+for it, and optionally keyword arguments that are recorded with the message
+as separate fields (for example, phase = 'tind', count = 120).  The message
+is only formatted if it is actually going to be written somewhere, so that
+calls to log() cost little on hot paths when debugging is off.
+
+Besides being written to the console when debugging is on, every event is
+kept in a small in-memory buffer of recent events, which is saved to a file
+in the user's data directory when a fatal error is reported, and can also
+be written to a file in JSON Lines format (one JSON object per event) if
+one is set in the configuration file.
+
 Authors
 -------
 
@@ -14,9 +26,56 @@ open-source software released under a 3-clause BSD license.  Please see the
 file "LICENSE" for more information.
 '''
 
+from   collections import deque
+from   datetime import datetime
+import json
+from   os import path
+import threading
+import time
+
 import holdit
 
-
+
+# Global constants.
+# .............................................................................
+
+_RECENT_EVENTS_FILE = 'recent-events.log'
+'''
+Name of the file in the user's data directory to which the recent events
+are saved when a fatal error is reported.
+'''
+
+_MUTABLE = (dict, list, set)
+'''
+Types of log() arguments that are copied when an event is recorded.
+'''
+
+
+# Global variables.
+# .............................................................................
+
+_settings = {
+    'recent_events' : 200,          # Number of recent events kept in memory.
+    'log_file'      : '',           # JSON Lines file for all events, if any.
+}
+'''
+Logging settings.  These can be changed using configure().
+'''
+
+_recent = deque(maxlen = _settings['recent_events'])
+'''
+The most recent events, as tuples of (time, thread name, format string,
+format arguments, fields).  Messages are only formatted when read.
+'''
+
+_sink = None
+'''
+The open JSON Lines file to which events are written, or None.
+'''
+
+_sink_lock = threading.Lock()
+
+
 # Logger configuration.
 # .............................................................................
 
@@ -29,10 +88,34 @@ if __debug__:
     handler.setLevel(logging.DEBUG)
     holdit_logger.addHandler(handler)
 
-
+
 # Exported functions.
 # .............................................................................
 
+def configure(**settings):
+    '''Changes the logging settings.  Recognized keyword arguments are
+    recent_events (the number of events kept in memory) and log_file (the
+    path of a file to which events are appended in JSON Lines format; a
+    relative path is taken to be relative to the user's data directory,
+    and an empty value turns the file off).'''
+    global _recent, _sink
+    for name, value in settings.items():
+        if name not in _settings:
+            raise ValueError('Unrecognized logging setting "{}"'.format(name))
+        if value is not None:
+            _settings[name] = type(_settings[name])(value)
+    _recent = deque(_recent, maxlen = max(_settings['recent_events'], 0))
+    log_file = _settings['log_file'].strip()
+    if log_file:
+        from holdit.files import user_data_path
+        log_file = path.join(user_data_path(), log_file)
+    with _sink_lock:
+        if _sink:
+            _sink.close()
+        _sink = open(log_file, 'a', encoding = 'utf-8', buffering = 1) if log_file else None
+    if __debug__: log('logging settings: {}', dict(_settings))
+
+
 def set_debug(enabled):
     '''Turns on debug logging if 'enabled' is True; turns it off otherwise.'''
     if __debug__:
@@ -40,8 +123,81 @@ def set_debug(enabled):
         logging.getLogger('holdit').setLevel(DEBUG if enabled else WARNING)
 
 
-def log(s, *other_args):
+def log(s, *other_args, **fields):
     '''Logs a debug message. 's' can contain format directive, and the
-    remaining arguments are the arguments to the format string.'''
+    remaining arguments are the arguments to the format string.  Keyword
+    arguments are recorded as fields of the event.  The message is only
+    formatted when it is written out, so arguments that are dictionaries,
+    lists or sets are copied, in case the caller changes them afterwards.'''
     if __debug__:
-        logging.getLogger('holdit').debug(s.format(*other_args))
+        if any(isinstance(arg, _MUTABLE) for arg in other_args):
+            other_args = tuple(_copy(arg) for arg in other_args)
+        if any(isinstance(value, _MUTABLE) for value in fields.values()):
+            fields = {name: _copy(value) for name, value in fields.items()}
+        event = (time.time(), threading.current_thread().name, s, other_args, fields)
+        _recent.append(event)
+        if _sink:
+            _write(event)
+        if holdit_logger.isEnabledFor(logging.DEBUG):
+            holdit_logger.debug(_text(event))
+
+
+def recent_events():
+    '''Returns a list of the recent events as lines of text, oldest first.'''
+    return [_text(event, with_time = True) for event in list(_recent)]
+
+
+def save_recent_events():
+    '''Writes the recent events to a file in the user's data directory.
+    Returns the path of the file, or None if there were no events to save
+    or the file could not be written.'''
+    lines = recent_events()
+    if not lines:
+        return None
+    from holdit.files import user_data_path
+    file = path.join(user_data_path(), _RECENT_EVENTS_FILE)
+    try:
+        with open(file, 'w', encoding = 'utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+    except OSError:
+        return None
+    return file
+
+
+# Miscellaneous utilities.
+# .............................................................................
+
+def _copy(value):
+    return value.copy() if isinstance(value, _MUTABLE) else value
+
+
+def _message(s, args):
+    if not args:
+        return s
+    try:
+        return s.format(*args)
+    except (IndexError, KeyError, ValueError):
+        return '{} {}'.format(s, args)
+
+
+def _text(event, with_time = False):
+    when, thread, s, args, fields = event
+    text = _message(s, args)
+    if fields:
+        text += ' [{}]'.format(' '.join('{}={}'.format(k, v) for k, v in fields.items()))
+    if with_time:
+        stamp = datetime.fromtimestamp(when).isoformat(' ', 'milliseconds')
+        text = '{} {}: {}'.format(stamp, thread, text)
+    return text
+
+
+def _write(event):
+    when, thread, s, args, fields = event
+    entry = {'time'    : datetime.fromtimestamp(when).isoformat(' ', 'milliseconds'),
+             'thread'  : thread,
+             'message' : _message(s, args)}
+    entry.update(fields)
+    line = json.dumps(entry, default = str)
+    with _sink_lock:
+        if _sink:
+            _sink.write(line + '\n')
@@ -0,0 +1,255 @@
+'''
+enrich.py: adding information from TIND detail pages to new hold requests
+
+The holds list in TIND only shows part of what is known about an item and a
+patron.  When enrichment is turned on in the configuration file, Hold It!
+fetches the item record page and the patron page of each new hold request
+(in parallel, using the session that is logged in to TIND) and adds the
+following fields to the record, for use in the print template:
+
+    item_full_call_number, item_volume, item_copy, requester_email
+
+Only new hold requests are enriched.  The values obtained for each page are
+kept in a cache file in the user's data directory for a configurable number
+of days, so that repeat patrons and items do not cause more network
+traffic.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+from   concurrent.futures import ThreadPoolExecutor
+import json
+from   lxml import etree, html
+import os
+from   os import path
+import re
+import threading
+import time
+from   urllib.parse import unquote, urljoin
+
+import holdit
+from holdit.files import user_data_path
+from holdit.metrics import increment
+from holdit.debug import log
+
+
+# Global constants.
+# .............................................................................
+
+_TIND_URL = 'https://caltech.tind.io'
+'''
+Base URL for the relative URLs found in the TIND holds list.
+'''
+
+_CACHE_FILE = 'detail-cache.json'
+'''
+Name of the cache file of values obtained from detail pages.
+'''
+
+_CACHE_VERSION = 2
+'''
+Version of the way values are extracted from detail pages.  Cached values
+extracted by other versions are not used.
+'''
+
+_ITEM_LABELS = {'item_full_call_number' : 'call number',
+                'item_volume'           : 'volume',
+                'item_copy'             : 'copy'}
+'''
+Fields obtained from item record pages, and the labels of their values.
+'''
+
+_EMAIL_LABELS = ['email', 'e-mail', 'email address']
+'''
+Labels of the patron's email address on patron pages.
+'''
+
+_EMAIL_REGEX = re.compile(r'[\w.+-]+@[\w-]+(\.[\w-]+)+')
+
+_LABEL_XPATH = etree.XPath(
+    '//*[self::th or self::td or self::dt or self::label or self::b'
+    '    or self::strong or self::span]'
+    '[{0} = $label or {0} = concat($label, ":")]'.format(
+        "translate(normalize-space(.), 'ABCDEFGHIJKLMNOPQRSTUVWXYZ',"
+        " 'abcdefghijklmnopqrstuvwxyz')"))
+'''
+Finds the elements whose whole text (ignoring case, surrounding space and
+a final colon) is the value of the variable $label.
+'''
+
+
+# Global variables.
+# .............................................................................
+
+_settings = {
+    'enabled'    : False,           # Whether to enrich new records at all.
+    'workers'    : 4,               # Max. detail pages fetched at once.
+    'cache_days' : 30,              # Days that cached values are used.
+}
+'''
+Enrichment settings.  These can be changed using configure().
+'''
+
+_cache_lock = threading.Lock()
+'''
+Lock held while reading or writing the cache file, because several
+profiles may be processed at the same time.
+'''
+
+
+# Exported functions.
+# .............................................................................
+
+def configure(**settings):
+    '''Changes the enrichment settings.  Recognized keyword arguments are
+    enabled, workers and cache_days.'''
+    for name, value in settings.items():
+        if name not in _settings:
+            raise ValueError('Unrecognized enrichment setting "{}"'.format(name))
+        if value is None:
+            continue
+        if isinstance(_settings[name], bool):
+            _settings[name] = str(value).strip().lower() in ['1', 'yes', 'true', 'on']
+        else:
+            _settings[name] = type(_settings[name])(value)
+    if __debug__: log('enrichment settings: {}', _settings)
+
+
+def enabled():
+    '''Returns True if enrichment has been turned on.'''
+    return _settings['enabled']
+
+
+def enrich_records(records, session):
+    '''Adds the fields obtained from TIND detail pages to each record in the
+    list 'records', using the requests session 'session', which must be
+    logged in to TIND.  Does nothing if enrichment is not enabled or if
+    'session' is None.  Pages that cannot be fetched leave the fields empty.'''
+    if not _settings['enabled'] or not session or not records:
+        return
+    pages = {}
+    for record in records:
+        if record.item_record_url:
+            pages[urljoin(_TIND_URL, record.item_record_url)] = _item_fields
+        if record.requester_url:
+            pages[urljoin(_TIND_URL, record.requester_url)] = _requester_fields
+
+    with _cache_lock:
+        cache = _read_cache()
+    now = time.time()
+    max_age = _settings['cache_days'] * 86400
+    values = {url: entry['fields'] for url, entry in cache.items()
+              if url in pages and _current(entry, now, max_age)}
+    increment('detail_cache_hits', len(values))
+    missing = [url for url in pages if url not in values]
+    if __debug__: log('enriching {} records: {} pages cached, {} to fetch',
+                      len(records), len(values), len(missing))
+
+    if missing:
+        with ThreadPoolExecutor(max_workers = _settings['workers']) as executor:
+            results = executor.map(lambda url: _fetch(session, url, pages[url]), missing)
+            fetched = dict(zip(missing, results))
+        with _cache_lock:
+            cache = _read_cache()
+            for url, fields in fetched.items():
+                if fields is not None:
+                    values[url] = fields
+                    cache[url] = {'time': now, 'version': _CACHE_VERSION,
+                                  'fields': fields}
+            try:
+                _write_cache({url: entry for url, entry in cache.items()
+                              if _current(entry, now, max_age)})
+            except OSError as err:
+                if __debug__: log('unable to write detail cache: {}', str(err))
+
+    for record in records:
+        fields = dict.fromkeys(list(_ITEM_LABELS) + ['requester_email'], '')
+        fields.update(values.get(urljoin(_TIND_URL, record.item_record_url), {}))
+        fields.update(values.get(urljoin(_TIND_URL, record.requester_url), {}))
+        for name, value in fields.items():
+            setattr(record, name, value)
+
+
+# Miscellaneous utilities.
+# .............................................................................
+
+def _fetch(session, url, extractor):
+    try:
+        res = session.get(url)
+        increment('detail_pages_fetched')
+        if res.status_code != 200:
+            if __debug__: log('{} returned status {}', url, res.status_code)
+            return None
+        return extractor(html.fromstring(res.content))
+    except Exception as err:
+        if __debug__: log('unable to get {}: {}', url, str(err))
+        return None
+
+
+def _item_fields(tree):
+    return {name: _labelled(tree, label)[0] for name, label in _ITEM_LABELS.items()}
+
+
+def _requester_fields(tree):
+    # Only the labelled email field is used.  Other addresses on the page
+    # (staff, help desk, footer) must not end up on the patron's hold slip.
+    for label in _EMAIL_LABELS:
+        text, element = _labelled(tree, label)
+        if element is not None:
+            for link in element.xpath('descendant-or-self::a[starts-with(@href, "mailto:")]'):
+                return {'requester_email': _mailto_address(link.get('href'))}
+        match = _EMAIL_REGEX.search(text)
+        if match:
+            return {'requester_email': match.group(0)}
+    return {'requester_email': ''}
+
+
+def _labelled(tree, label):
+    # Finds an element whose whole text is the label (e.g., a table header
+    # cell or a <dt>), and returns the text and the element after it, or the
+    # text that follows it and None.
+    for element in _LABEL_XPATH(tree, label = label):
+        following = element.getnext()
+        if following is not None:
+            return following.text_content().strip(), following
+        return (element.tail or '').strip(), None
+    return '', None
+
+
+def _mailto_address(href):
+    # "mailto:a@b.edu?subject=..." => "a@b.edu"
+    return unquote(href[len('mailto:'):].split('?', 1)[0]).strip()
+
+
+def _current(entry, now, max_age):
+    return entry.get('version') == _CACHE_VERSION and now - entry['time'] < max_age
+
+
+def _read_cache():
+    cache_file = path.join(user_data_path(), _CACHE_FILE)
+    if not path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file, 'r', encoding = 'utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as err:
+        if __debug__: log('ignoring unreadable detail cache: {}', str(err))
+        return {}
+
+
+def _write_cache(cache):
+    cache_file = path.join(user_data_path(), _CACHE_FILE)
+    temp_file = cache_file + '.tmp'
+    with open(temp_file, 'w', encoding = 'utf-8') as f:
+        json.dump(cache, f)
+    os.replace(temp_file, cache_file)
@@ -0,0 +1,206 @@
+'''
+exporter.py: writing run metrics to a file for monitoring systems
+
+When Hold It! is run unattended (for example, from a scheduled task), the
+values recorded in metrics.py can be written to a file at the end of each
+run, so that they can be picked up by a monitoring system.  Two formats are
+supported:
+
+  * "prometheus": the text format read by the Prometheus node exporter's
+    textfile collector (the file name must then end in ".prom")
+  * "json": a JSON object with a list of the values
+
+The file is replaced atomically, so that a collector never reads a
+partially written file.  The time of the last successful run is kept in the
+user's data directory and included in every export, so that a monitoring
+system can tell when runs have been failing for a while.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import json
+import os
+from   os import path
+import time
+
+import holdit
+from holdit.files import user_data_path
+from holdit.metrics import set_value, snapshot
+from holdit.debug import log
+
+
+# Global constants.
+# .............................................................................
+
+_FORMATS = ['none', 'prometheus', 'json']
+
+_DEFAULT_FILES = {'prometheus': 'holdit.prom', 'json': 'holdit-metrics.json'}
+'''
+Names of the files written in the user's data directory when the
+configuration does not give a file.
+'''
+
+_LAST_SUCCESS_FILE = 'last-success.json'
+'''
+Name of the file in the user's data directory that records the time of the
+last successful run.
+'''
+
+_PREFIX = 'holdit_'
+'''
+Prefix added to the names of the metrics in Prometheus format.
+'''
+
+_ALWAYS_EXPORTED = ['http_retries', 'pages_rendered', 'sheet_rows_appended']
+'''
+Metrics that are exported (with the value 0) even if nothing recorded them,
+so that monitoring rules do not have to handle missing values.
+'''
+
+_DESCRIPTIONS = {
+    'run_success'            : 'Whether the last run succeeded (1) or failed (0).',
+    'run_timestamp_seconds'  : 'Time at which the last run ended.',
+    'run_seconds'            : 'Duration of the last run.',
+    'last_success_timestamp_seconds' : 'Time at which the last successful run ended.',
+    'stage_items'            : 'Records that passed through each processing stage.',
+    'stage_seconds'          : 'Wall time spent producing the records of each stage.',
+    'phase_seconds'          : 'Wall time spent in each phase of the run.',
+    'http_requests'          : 'HTTP requests made.',
+    'http_seconds'           : 'Time spent waiting for HTTP responses.',
+    'http_retries'           : 'HTTP requests retried after transient failures.',
+    'sheet_rows_appended'    : 'Rows appended to the tracking spreadsheets.',
+    'pages_rendered'         : 'Pages rendered into printable documents.',
+}
+'''
+Help text for the metrics, used in the Prometheus format.
+'''
+
+
+# Global variables.
+# .............................................................................
+
+_settings = {
+    'format' : 'none',              # One of the values in _FORMATS.
+    'file'   : '',                  # Output file; default in user data dir.
+}
+'''
+Metrics export settings.  These can be changed using configure().
+'''
+
+
+# Exported functions.
+# .............................................................................
+
+def configure(**settings):
+    '''Changes the metrics export settings.  Recognized keyword arguments
+    are format ("none", "prometheus" or "json") and file.'''
+    for name, value in settings.items():
+        if name not in _settings:
+            raise ValueError('Unrecognized metrics setting "{}"'.format(name))
+        if value is not None:
+            _settings[name] = str(value).strip()
+    _settings['format'] = _settings['format'].lower() or 'none'
+    if _settings['format'] not in _FORMATS:
+        raise ValueError('Unrecognized metrics format "{}"'.format(_settings['format']))
+    if __debug__: log('metrics settings: {}', _settings)
+
+
+def export_metrics(succeeded, run_seconds):
+    '''Records the outcome of the run and its duration, and writes all the
+    metrics to the configured file.  Returns the path of the file written,
+    or None if exporting is turned off.'''
+    if _settings['format'] == 'none':
+        return None
+    now = time.time()
+    last_success = _last_success(now if succeeded else None)
+    set_value('run_success', int(bool(succeeded)))
+    set_value('run_timestamp_seconds', round(now, 3))
+    set_value('run_seconds', round(run_seconds, 3))
+    if last_success is not None:
+        set_value('last_success_timestamp_seconds', round(last_success, 3))
+
+    values = snapshot()
+    for name in _ALWAYS_EXPORTED:
+        if not any(key[0] == name for key in values):
+            values[(name, ())] = 0
+    if _settings['format'] == 'prometheus':
+        content = _prometheus_text(values)
+    else:
+        content = json.dumps(_json_content(values, now), indent = 2) + '\n'
+
+    file = _settings['file'] or _DEFAULT_FILES[_settings['format']]
+    file = path.join(user_data_path(), path.expanduser(file))
+    temp_file = file + '.tmp'
+    with open(temp_file, 'w', encoding = 'utf-8') as f:
+        f.write(content)
+    os.replace(temp_file, file)
+    if __debug__: log('wrote {} metrics to {}', len(values), file)
+    return file
+
+
+# Miscellaneous utilities.
+# .............................................................................
+
+def _last_success(now):
+    # Returns the time of the last successful run, after recording 'now' as
+    # that time if it is not None.
+    state_file = path.join(user_data_path(), _LAST_SUCCESS_FILE)
+    if now is not None:
+        temp_file = state_file + '.tmp'
+        with open(temp_file, 'w', encoding = 'utf-8') as f:
+            json.dump({'timestamp': now}, f)
+        os.replace(temp_file, state_file)
+        return now
+    try:
+        with open(state_file, 'r', encoding = 'utf-8') as f:
+            return float(json.load(f)['timestamp'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _prometheus_text(values):
+    lines = []
+    for name in sorted(set(key[0] for key in values)):
+        metric = _PREFIX + name
+        if name in _DESCRIPTIONS:
+            lines.append('# HELP {} {}'.format(metric, _DESCRIPTIONS[name]))
+        lines.append('# TYPE {} gauge'.format(metric))
+        family = sorted((k, v) for k, v in values.items() if k[0] == name)
+        # All the samples of a metric must have the same label names, so
+        # labels that some samples lack are given empty values.
+        label_names = sorted(set(label for (_, labels), _ in family for label, _ in labels))
+        for (_, labels), value in family:
+            if label_names:
+                labels = dict(labels)
+                label_text = ','.join('{}="{}"'.format(label, _escaped(labels.get(label, '')))
+                                      for label in label_names)
+                lines.append('{}{{{}}} {}'.format(metric, label_text, _number(value)))
+            else:
+                lines.append('{} {}'.format(metric, _number(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def _json_content(values, now):
+    metrics = [{'name': name, 'labels': dict(labels), 'value': value}
+               for (name, labels), value in sorted(values.items(), key = lambda kv: kv[0])]
+    return {'timestamp': round(now, 3), 'metrics': metrics}
+
+
+def _escaped(text):
+    return str(text).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
@@ -25,8 +25,10 @@ import sys
 import tempfile
 
 import holdit
+from holdit.callnumbers import sort_key
 from holdit.files import holdit_path, module_path, readable, datadir_path
 from holdit.exceptions import InternalError
+from holdit.metrics import increment
 
 
 # Global constants.
@@ -38,13 +40,11 @@ _DEFAULT_TEMPLATE = 'default_template.docx'
 # Printing code.
 # .............................................................................
 
-def printable_doc(records_list, explicit_template):
-    '''Generates a Word .docx file with one page for each record. Returns
-    a Python docx Document object.'''
+def printable_doc(records, explicit_template):
+    '''Generates a Word .docx file with one page for each record in the
+    iterable 'records'.  Returns a Python docx Document object, or None if
+    there are no records.'''
 
-    num_pages = len(records_list)
-    if num_pages < 1:
-        return None
     template = explicit_template or normal_template()
     if not readable(template):
         raise InternalError('Cannot find a template file for printing.')
@@ -54,23 +54,22 @@ def printable_doc(records_list, explicit_template):
     # the results caused Word to complain that the file was corrupted.  The
     # algorithm below writes out a separate file for each record, then in a
     # subsequent loop, uses docxcompose to combine individual docx Document
-    # objects for each file into one overall docx.
+    # objects for each file into one overall docx.  Each record is rendered
+    # once we know whether another one follows it, because every page except
+    # the last one needs a page break.
 
     files_list = []
-    for index, record in enumerate(records_list):
-        tmpfile = tempfile.TemporaryFile()
-        doc = DocxTemplate(template)
-        values = vars(records_list[index])
-        values = {k : sanitized_string(v) for k, v in values.items()}
-        values.update(date_time_stamps)
-        doc.render(values)
-        if index < (num_pages - 1):
-            doc.add_page_break()
-        doc.save(tmpfile)
-        files_list.append(tmpfile)
+    previous = None
+    for record in records:
+        if previous is not None:
+            files_list.append(rendered_page(previous, template, date_time_stamps, True))
+        previous = record
+    if previous is None:
+        return None
+    files_list.append(rendered_page(previous, template, date_time_stamps, False))
 
     if len(files_list) < 2:
-        return doc
+        return Document(files_list[0])
     else:
         # The only way I found to create a viable single .docx file containing
         # multiple pages is to create separate docx Document objects out of
@@ -80,7 +79,40 @@ def printable_doc(records_list, explicit_template):
             composer.append(Document(page))
         return composer
 
-
+
+def rendered_page(record, template, date_time_stamps, page_break):
+    '''Renders 'record' using the 'template' file, and returns a temporary
+    file containing the resulting .docx document.'''
+    tmpfile = tempfile.TemporaryFile()
+    doc = DocxTemplate(template)
+    values = record.as_dict()
+    values = {k : sanitized_string(v) for k, v in values.items()}
+    values.update(date_time_stamps)
+    doc.render(values)
+    if page_break:
+        doc.add_page_break()
+    doc.save(tmpfile)
+    increment('pages_rendered')
+    return tmpfile
+
+
+def records_by_location(records):
+    '''Groups 'records' by item location code.  Returns a dictionary whose
+    keys are location codes and whose values are lists of records, each
+    list sorted in shelf order.'''
+    groups = {}
+    for record in records:
+        groups.setdefault(record.item_location_code or 'unknown', []).append(record)
+    for group in groups.values():
+        group.sort(key = shelf_order)
+    return groups
+
+
+def shelf_order(record):
+    '''Returns a value for sorting records by the call numbers of items.'''
+    return sort_key(record.item_call_number)
+
+
 # Misc. helper code.
 # .............................................................................
 
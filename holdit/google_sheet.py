@@ -15,12 +15,16 @@ file "LICENSE" for more information.
 '''
 
 from apiclient.discovery import build
+from datetime import datetime, timedelta
 from httplib2 import Http
 from oauth2client import client, tools
 from oauth2client.client import OAuth2WebServerFlow
 from os import path
 import json as jsonlib
+import re
 import sys
+import threading
+from threading import Thread
 
 # oauth2client library loads keyring but does not set a backend, which
 # leads to a run-time error in the PyInstaller-produced app.
@@ -34,8 +38,9 @@ elif sys.platform.startswith('win'):
 
 import holdit
 from holdit.exceptions import *
-from holdit.records import HoldRecord
+from holdit.records import HoldRecord, request_key
 from holdit.files import open_url, datadir_path
+from holdit.metrics import increment
 from holdit.debug import log
 from holdit.token_storage import TokenStorage
 
@@ -57,6 +62,24 @@ _SECRETS_FILE = 'client_secrets.json'
 # actual spreadsheet when moving to production.
 _GS_BASE_URL = 'https://docs.google.com/spreadsheets/d/'
 
+# Columns that reconcile_google() may change, as tuples of (column number,
+# record fields whose values are shown in that column).  The columns left
+# out hold the request date (which is part of the identity of a request)
+# and the values maintained by the circulation staff.
+_RECONCILED_COLUMNS = [(0, ['requester_name', 'requester_type']),
+                       (1, ['item_title', 'item_loan_status']),
+                       (2, ['item_barcode', 'item_call_number']),
+                       (4, ['overdue_notices_count']),
+                       (5, ['holds_count']),
+                       (6, ['item_location_code'])]
+
+# Access tokens expiring sooner than this are refreshed ahead of time.
+_TOKEN_REFRESH_MARGIN = timedelta(minutes = 5)
+
+# Pattern for the cell formulas created by link().
+_LINK_REGEX = re.compile(r'=HYPERLINK\("((?:[^"]|"")*)"\s*[,;]\s*"((?:[^"]|"")*)"\)\s*$',
+                         re.DOTALL | re.IGNORECASE)
+
 
 # Class definitions.
 # .............................................................................
@@ -71,6 +94,7 @@ class GoogleHoldRecord(HoldRecord):
         self.caltech_status = ''
         self.caltech_staff_initials = ''
         self.caltech_holdit_user = ''
+        self.sheet_row = None           # Row number in sheet, if known.
         if record:
             self.requester_name        = record.requester_name
             self.requester_type        = record.requester_type
@@ -91,82 +115,152 @@ class GoogleHoldRecord(HoldRecord):
             self.holds_count           = record.holds_count
 
 
+class CredentialsPrefetcher(Thread):
+    '''Thread that loads the stored Google API token for a user and, if the
+    access token has expired or is about to, refreshes it.  Starting this
+    early in a run takes the token endpoint round trip off the critical
+    path of the first call to the Google Sheets API.'''
+
+    def __init__(self, user):
+        Thread.__init__(self, name = "CredentialsPrefetcher")
+        self.daemon = True
+        self.credentials = None
+        self._user = user
+
+
+    def run(self):
+        try:
+            creds = TokenStorage('Holdit!', self._user).get()
+            if creds and not creds.invalid and _token_expiring(creds):
+                if __debug__: log('Refreshing Google API token in background')
+                # The credentials object's store is our TokenStorage, and
+                # refresh() saves the new token to it using locked_put().
+                creds.refresh(Http())
+                if __debug__: log('Google API token refreshed')
+            self.credentials = creds
+        except Exception as err:
+            # Leave it to spreadsheet_credentials() to deal with problems.
+            if __debug__: log('Background token refresh failed: {}', err)
+
+
 # Main code.
 # .............................................................................
 
+_prefetchers = {}
+
+# Credentials and service objects are shared by all threads and created only
+# once per user.  HTTP objects are kept per thread.
+_credentials = {}
+_credentials_lock = threading.Lock()
+_services = {}
+_services_lock = threading.Lock()
+_thread_data = threading.local()
+
+def prefetch_credentials(user):
+    '''Starts getting the Google API credentials for 'user' in a background
+    thread.  The result is picked up by the next call to
+    spreadsheet_credentials() for the same user.'''
+    if user and user not in _prefetchers:
+        if __debug__: log('Starting background fetch of Google API token')
+        _prefetchers[user] = CredentialsPrefetcher(user)
+        _prefetchers[user].start()
+
+
 # The following credentials and connection code is based on the Google examples
 # found at https://developers.google.com/sheets/api/quickstart/python
 
 def records_from_google(gs_id, user, message_handler):
+    '''Returns a generator of GoogleHoldRecord objects for the rows in the
+    spreadsheet.  The spreadsheet is read immediately, but the records are
+    only created as the caller iterates over the generator.'''
     if __debug__: log('Getting entries from Google spreadsheet')
     spreadsheet_rows = spreadsheet_content(gs_id, user, message_handler)
-    if spreadsheet_rows == []:
-        return []
+    if __debug__: log('Building records from spreadsheet rows', phase = 'google',
+                      count = max(len(spreadsheet_rows) - 1, 0))
+    return _google_records(spreadsheet_rows)
+
+
+def _google_records(spreadsheet_rows):
     # First row is the title row.
-    results = []
-    if __debug__: log('Building records from {} rows', len(spreadsheet_rows) - 1)
     for index, row in enumerate(spreadsheet_rows[1:], start = 1):
         if not row or len(row) < 8:     # Empty or junk row.
             continue
+        record = record_from_row(row)
+        record.sheet_row = index + 1
+        yield record
 
-        record = GoogleHoldRecord()
 
-        cell = row[0]
-        end = cell.find('\n')
-        if end:
-            record.requester_name = cell[:end].strip()
-            record.requester_type = cell[end + 1:].strip()
-        else:
-            record.requester_name = cell.strip()
+def record_from_row(row):
+    '''Returns a GoogleHoldRecord built from the cell values in 'row'.'''
+    record = GoogleHoldRecord()
 
-        cell = row[1]
-        end = cell.find('\n')
-        if end:
-            record.item_title = cell[:end].strip()
-            record.item_loan_status = cell[end + 1:].strip()
-        else:
-            record.item_title = cell.strip()
+    cell = row[0]
+    end = cell.find('\n')
+    if end:
+        record.requester_name = cell[:end].strip()
+        record.requester_type = cell[end + 1:].strip()
+    else:
+        record.requester_name = cell.strip()
 
-        cell = row[2]
-        end = cell.find('\n')
-        if end:
-            record.item_barcode = cell[:end]
-            record.item_call_number = cell[end + 1:].strip()
-        else:
-            record.item_title = cell.strip()
+    cell = row[1]
+    end = cell.find('\n')
+    if end:
+        record.item_title = cell[:end].strip()
+        record.item_loan_status = cell[end + 1:].strip()
+    else:
+        record.item_title = cell.strip()
 
-        cell = row[3]
-        record.date_requested = cell.strip()
+    cell = row[2]
+    end = cell.find('\n')
+    if end:
+        record.item_barcode = cell[:end]
+        record.item_call_number = cell[end + 1:].strip()
+    else:
+        record.item_title = cell.strip()
 
-        cell = row[4]
-        record.overdue_notices_count = cell.strip()
+    cell = row[3]
+    record.date_requested = cell.strip()
 
-        cell = row[5]
-        record.holds_count = cell.strip()
+    cell = row[4]
+    record.overdue_notices_count = cell.strip()
 
-        cell = row[6]
-        record.item_location_code = cell.strip()
+    cell = row[5]
+    record.holds_count = cell.strip()
 
-        if len(row) > 7:
-            cell = row[7]
-            record.caltech_holdit_user = cell.strip()
+    cell = row[6]
+    record.item_location_code = cell.strip()
 
-        if len(row) > 8:
-            cell = row[8]
-            record.caltech_status = cell.strip()
+    if len(row) > 7:
+        cell = row[7]
+        record.caltech_holdit_user = cell.strip()
 
-        if len(row) > 9:
-            cell = row[9]
-            record.caltech_staff_initials = cell.strip()
+    if len(row) > 8:
+        cell = row[8]
+        record.caltech_status = cell.strip()
 
-        results.append(record)
-    return results
+    if len(row) > 9:
+        cell = row[9]
+        record.caltech_staff_initials = cell.strip()
+
+    return record
 
 
 def spreadsheet_credentials(user, message_handler):
+    with _credentials_lock:
+        if user not in _credentials:
+            _credentials[user] = _new_spreadsheet_credentials(user, message_handler)
+        return _credentials[user]
+
+
+def _new_spreadsheet_credentials(user, message_handler):
     if __debug__: log('Getting token for Google API')
     store = TokenStorage('Holdit!', user)
-    creds = store.get()
+    prefetcher = _prefetchers.pop(user, None)
+    if prefetcher:
+        prefetcher.join()
+        creds = prefetcher.credentials or store.get()
+    else:
+        creds = store.get()
     if not creds or creds.invalid:
         if __debug__: log('Using secrets file for Google API')
         secrets_file = path.join(datadir_path(), _SECRETS_FILE)
@@ -183,14 +277,40 @@ def spreadsheet_credentials(user, message_handler):
     return creds
 
 
+def spreadsheet_service(user, message_handler):
+    '''Returns a Google Sheets API service object authorized for 'user'.
+    The object is created once and shared by all threads.  The HTTP objects
+    used by the Google API library are not thread-safe, so requests created
+    using the service object must be executed using the object returned by
+    authorized_http(), as in request.execute(http = http).'''
+    with _services_lock:
+        if user not in _services:
+            creds = spreadsheet_credentials(user, message_handler)
+            if __debug__: log('Building Google sheets service object')
+            _services[user] = build('sheets', 'v4', http = creds.authorize(Http()),
+                                    cache_discovery = False)
+        return _services[user]
+
+
+def authorized_http(user, message_handler):
+    '''Returns an HTTP object authorized for 'user', for use by the calling
+    thread only.'''
+    if not hasattr(_thread_data, 'https'):
+        _thread_data.https = {}
+    if user not in _thread_data.https:
+        creds = spreadsheet_credentials(user, message_handler)
+        _thread_data.https[user] = creds.authorize(Http())
+    return _thread_data.https[user]
+
+
 def spreadsheet_content(gs_id, user, message_handler):
-    creds = spreadsheet_credentials(user, message_handler)
-    if __debug__: log('Building Google sheets service object')
-    service = build('sheets', 'v4', http = creds.authorize(Http()), cache_discovery = False)
+    service = spreadsheet_service(user, message_handler)
+    http = authorized_http(user, message_handler)
     sheets_service = service.spreadsheets().values()
     try:
         # If you don't supply a sheet name in the range arg, you get 1st sheet.
-        data = sheets_service.get(spreadsheetId = gs_id, range = 'A:Z').execute()
+        data = sheets_service.get(spreadsheetId = gs_id,
+                                  range = 'A:Z').execute(http = http)
     except Exception as err:
         text = 'attempted connection to Google resulted in {}'.format(err)
         if __debug__: log(text)
@@ -208,22 +328,161 @@ def update_google(gs_id, records, user, message_handler):
         data.append(google_row_for_record(record))
     if not data:
         return
-    creds = spreadsheet_credentials(user, message_handler)
-    if __debug__: log('Building Google sheets service object')
-    service = build('sheets', 'v4', http = creds.authorize(Http()), cache_discovery = False)
+    service = spreadsheet_service(user, message_handler)
+    http = authorized_http(user, message_handler)
     sheets_service = service.spreadsheets().values()
     body = {'values': data}
     try:
         if __debug__: log('Calling Google API for updating data')
         result = sheets_service.append(spreadsheetId = gs_id,
                                        range = 'A:Z', body = body,
-                                       valueInputOption = 'USER_ENTERED').execute()
+                                       valueInputOption = 'USER_ENTERED'
+                                       ).execute(http = http)
     except Exception as err:
         text = 'attempted connection to Google resulted in {}'.format(err)
         if __debug__: log(text)
         message_handler.error('Unable to update Google spreadsheet', text)
         raise InternalError(text)
     if __debug__: log('Google call successful')
+    increment('sheet_rows_appended', len(data))
+
+
+def reconcile_google(gs_id, records, known_records, user, message_handler):
+    '''Updates the rows of 'known_records' whose TIND values have changed
+    according to 'records'.  'known_records' must be a dictionary of request
+    keys to records obtained using records_from_google(), as produced by
+    records_index().  Only the cells whose values differ are written, using
+    a single batch update call.  Returns the number of ranges updated.'''
+    data = []
+    for record in records:
+        existing = known_records.get(request_key(record))
+        if existing and existing.sheet_row:
+            data += _changed_ranges(existing, GoogleHoldRecord(record))
+    if not data:
+        if __debug__: log('No changes to existing rows in Google spreadsheet')
+        return 0
+    service = spreadsheet_service(user, message_handler)
+    http = authorized_http(user, message_handler)
+    body = {'valueInputOption': 'USER_ENTERED', 'data': data}
+    try:
+        if __debug__: log('Calling Google API to update {} ranges', len(data))
+        service.spreadsheets().values().batchUpdate(spreadsheetId = gs_id,
+                                                    body = body).execute(http = http)
+    except Exception as err:
+        text = 'attempted connection to Google resulted in {}'.format(err)
+        if __debug__: log(text)
+        message_handler.error('Unable to update Google spreadsheet', text)
+        raise InternalError(text)
+    if __debug__: log('Google call successful')
+    return len(data)
+
+
+def archive_google(gs_id, user, message_handler, archive_tab):
+    '''Moves rows out of the first sheet of the spreadsheet and into archive
+    sheets (tabs).  'archive_tab' is a function that is given a
+    GoogleHoldRecord and returns the title of the tab where the row should
+    be moved, or None if the row should stay where it is.  Tabs that do not
+    exist yet are created.  Returns the list of records that were moved.
+    '''
+    service = spreadsheet_service(user, message_handler)
+    http = authorized_http(user, message_handler)
+    try:
+        if __debug__: log('Getting list of sheets in Google spreadsheet')
+        info = service.spreadsheets().get(spreadsheetId = gs_id,
+                                          fields = 'sheets.properties').execute(http = http)
+        sheets = [s['properties'] for s in info.get('sheets', [])]
+        main_sheet = sheets[0]
+        # Read formulas rather than displayed values, so that the links in
+        # the cells are preserved when the rows are copied elsewhere.
+        if __debug__: log('Reading rows of sheet "{}"', main_sheet['title'])
+        data = service.spreadsheets().values().get(
+            spreadsheetId = gs_id, range = _sheet_range(main_sheet['title']),
+            valueRenderOption = 'FORMULA',
+            dateTimeRenderOption = 'FORMATTED_STRING').execute(http = http)
+    except Exception as err:
+        text = 'attempted connection to Google resulted in {}'.format(err)
+        if __debug__: log(text)
+        message_handler.error('Unable to read Google spreadsheet', text)
+        raise InternalError(text)
+
+    rows = data.get('values', [])
+    if len(rows) < 2:
+        return []
+    header = rows[0]
+    moved_rows = {}                     # Tab title -> list of row values.
+    moved_records = []
+    moved_indexes = []                  # 0-based row indexes in main sheet.
+    for index, row in enumerate(rows[1:], start = 1):
+        if not row or len(row) < 8:
+            continue
+        record = record_from_row([link_text(cell) for cell in row])
+        tab = archive_tab(record)
+        if tab:
+            moved_rows.setdefault(tab, []).append(row)
+            moved_records.append(record)
+            moved_indexes.append(index)
+    if not moved_records:
+        if __debug__: log('No rows need to be archived')
+        return []
+    if __debug__: log('Archiving {} rows into {} tabs', len(moved_records), len(moved_rows))
+
+    existing_tabs = [s['title'] for s in sheets]
+    next_id = max(s['sheetId'] for s in sheets) + 1
+    new_tabs = []
+    for title in sorted(moved_rows):
+        if title not in existing_tabs:
+            new_tabs.append({'addSheet': {'properties': {'title': title,
+                                                         'sheetId': next_id}}})
+            moved_rows[title].insert(0, header)
+            next_id += 1
+    try:
+        if new_tabs:
+            if __debug__: log('Creating {} new archive tabs', len(new_tabs))
+            service.spreadsheets().batchUpdate(spreadsheetId = gs_id,
+                                               body = {'requests': new_tabs}
+                                               ).execute(http = http)
+        # Copy the rows before deleting them, so that a failure part-way
+        # through can at worst duplicate rows but never lose them.
+        for title, values in moved_rows.items():
+            if __debug__: log('Appending {} rows to tab "{}"', len(values), title)
+            service.spreadsheets().values().append(
+                spreadsheetId = gs_id, range = _sheet_range(title),
+                body = {'values': values},
+                valueInputOption = 'USER_ENTERED').execute(http = http)
+        # Rows are deleted by position.  If the sheet was sorted or rows were
+        # inserted or deleted since we read it, the positions are wrong, so
+        # check that every row is still where it was before deleting it.
+        if __debug__: log('Re-reading sheet "{}" before deleting rows', main_sheet['title'])
+        current = service.spreadsheets().values().get(
+            spreadsheetId = gs_id, range = _sheet_range(main_sheet['title']),
+            valueRenderOption = 'FORMULA',
+            dateTimeRenderOption = 'FORMATTED_STRING').execute(http = http)
+        changed = _moved_rows_changed(rows, current.get('values', []), moved_indexes)
+        deletions = [{'deleteDimension': {'range': {'sheetId': main_sheet['sheetId'],
+                                                    'dimension': 'ROWS',
+                                                    'startIndex': start,
+                                                    'endIndex': end}}}
+                     for start, end in _row_spans(moved_indexes)]
+        if not changed:
+            if __debug__: log('Deleting {} row spans from main sheet', len(deletions))
+            service.spreadsheets().batchUpdate(spreadsheetId = gs_id,
+                                               body = {'requests': deletions}
+                                               ).execute(http = http)
+    except Exception as err:
+        text = 'attempted connection to Google resulted in {}'.format(err)
+        if __debug__: log(text)
+        message_handler.error('Unable to archive rows in Google spreadsheet', text)
+        raise InternalError(text)
+    if changed:
+        text = ('rows {} of sheet "{}" changed while archiving; the rows were copied'
+                ' to the archive tabs but not deleted from the main sheet'
+                .format(', '.join(str(index + 1) for index in changed[:10]),
+                        main_sheet['title']))
+        if __debug__: log(text)
+        message_handler.error('The spreadsheet was changed while archiving', text)
+        raise InternalError(text)
+    if __debug__: log('Google call successful')
+    return moved_records
 
 
 def open_google(gs_id):
@@ -254,6 +513,14 @@ def google_row_for_record(record):
     return [a, b, c, d, e, f, g, h, i, j]
 
 
+def _token_expiring(creds):
+    '''Returns True if the access token in 'creds' has expired or will expire
+    within _TOKEN_REFRESH_MARGIN.  The token_expiry value is in UTC.'''
+    if not creds.token_expiry:
+        return creds.access_token is None
+    return creds.token_expiry - datetime.utcnow() < _TOKEN_REFRESH_MARGIN
+
+
 def google_flow(secrets_file, scope):
     # Code based on https://stackoverflow.com/a/28890297/743730
     with open(secrets_file, 'r') as fp:
@@ -273,3 +540,64 @@ def google_flow(secrets_file, scope):
 
 def link(value, url):
     return '=HYPERLINK("{}","{}")'.format(url, value)
+
+
+def link_text(cell):
+    '''Returns the displayed text of 'cell' if it is a HYPERLINK formula
+    created by link(), or else the unchanged cell value as a string.'''
+    if not isinstance(cell, str):
+        return str(cell)
+    match = _LINK_REGEX.match(cell)
+    return match.group(2).replace('""', '"') if match else cell
+
+
+def _changed_ranges(old, new):
+    '''Compares GoogleHoldRecords 'old' (from the spreadsheet) and 'new'
+    (from TIND), and returns a list of value ranges (in the form expected by
+    the Sheets API values.batchUpdate call) for the cells that differ.
+    Adjacent changed cells in the row are combined into a single range.'''
+    changed = [column for column, fields in _RECONCILED_COLUMNS
+               if any(str(getattr(old, f)).strip() != str(getattr(new, f)).strip()
+                      for f in fields)]
+    if not changed:
+        return []
+    if __debug__: log('row {} changed in columns {}', old.sheet_row, changed)
+    row = google_row_for_record(new)
+    spans = []
+    for column in changed:
+        if spans and spans[-1][-1] == column - 1:
+            spans[-1].append(column)
+        else:
+            spans.append([column])
+    ranges = []
+    for span in spans:
+        first = '{}{}'.format(chr(ord('A') + span[0]), old.sheet_row)
+        last = '{}{}'.format(chr(ord('A') + span[-1]), old.sheet_row)
+        cells = first if len(span) == 1 else first + ':' + last
+        ranges.append({'range': cells, 'values': [row[span[0] : span[-1] + 1]]})
+    return ranges
+
+
+def _sheet_range(title):
+    '''Returns an A1-notation range covering columns A:Z of sheet 'title'.'''
+    return "'{}'!A:Z".format(title.replace("'", "''"))
+
+
+def _moved_rows_changed(original_rows, current_rows, indexes):
+    '''Returns the 0-based indexes, among 'indexes', of the rows that are not
+    the same in 'current_rows' as in 'original_rows'.'''
+    return [index for index in indexes
+            if index >= len(current_rows) or current_rows[index] != original_rows[index]]
+
+
+def _row_spans(indexes):
+    '''Given a list of row indexes, returns (start, end) tuples of contiguous
+    spans in descending order, suitable for deleting rows without the
+    deletions affecting the positions of the remaining spans.'''
+    spans = []
+    for index in sorted(indexes):
+        if spans and spans[-1][1] == index:
+            spans[-1][1] = index + 1
+        else:
+            spans.append([index, index + 1])
+    return [tuple(span) for span in reversed(spans)]
@@ -0,0 +1,238 @@
+'''
+history.py: local, searchable history of hold requests
+
+Every run of Hold It! reads the whole tracking spreadsheet and the current
+hold requests in TIND.  The code in this module keeps what was seen in a
+small SQLite database in the user's data directory, so that questions such
+as "was this barcode or patron already handled?" can be answered offline
+and without opening the spreadsheet.  When the version of SQLite used by
+Python supports FTS5, the database includes a full-text index over the
+requester names, item titles, barcodes, call numbers and Caltech statuses;
+otherwise, searches fall back to slower substring matching.
+
+Rows are only written when something about a request has changed, so
+feeding the same records to the database on every run is cheap.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+from   datetime import datetime
+from   os import path
+import sqlite3
+
+import holdit
+from holdit.dates import parsed_datetime
+from holdit.files import user_data_path
+from holdit.debug import log
+
+
+# Global constants.
+# .............................................................................
+
+_HISTORY_FILE = 'history.db'
+'''
+Name of the history database file in the user's data directory.
+'''
+
+_SEARCH_LIMIT = 50
+'''
+Default maximum number of results returned by HoldHistory.search().
+'''
+
+_LOCK_TIMEOUT = 30
+'''
+Seconds to wait for another thread or process to release the database.
+'''
+
+_KEY_COLUMNS = ['item_barcode', 'date_requested', 'requester_name']
+
+_VALUE_COLUMNS = ['requester_type', 'item_title', 'item_call_number',
+                  'item_location_code', 'item_loan_status', 'caltech_status',
+                  'caltech_staff_initials']
+
+_INDEXED_COLUMNS = ['requester_name', 'item_title', 'item_barcode',
+                    'item_call_number', 'caltech_status']
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS requests (
+    id                     INTEGER PRIMARY KEY,
+    item_barcode           TEXT NOT NULL,
+    date_requested         TEXT NOT NULL,
+    requester_name         TEXT NOT NULL,
+    requester_type         TEXT,
+    item_title             TEXT,
+    item_call_number       TEXT,
+    item_location_code     TEXT,
+    item_loan_status       TEXT,
+    caltech_status         TEXT,
+    caltech_staff_initials TEXT,
+    first_seen             TEXT NOT NULL,
+    status_seen            TEXT,
+    UNIQUE (item_barcode, date_requested, requester_name)
+);
+'''
+
+_FTS_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS requests_fts USING fts5(
+    {columns}, content = 'requests', content_rowid = 'id');
+CREATE TRIGGER IF NOT EXISTS requests_ai AFTER INSERT ON requests BEGIN
+    INSERT INTO requests_fts (rowid, {columns}) VALUES ({new});
+END;
+CREATE TRIGGER IF NOT EXISTS requests_ad AFTER DELETE ON requests BEGIN
+    INSERT INTO requests_fts (requests_fts, rowid, {columns})
+        VALUES ('delete', {old});
+END;
+CREATE TRIGGER IF NOT EXISTS requests_au AFTER UPDATE ON requests BEGIN
+    INSERT INTO requests_fts (requests_fts, rowid, {columns})
+        VALUES ('delete', {old});
+    INSERT INTO requests_fts (rowid, {columns}) VALUES ({new});
+END;
+'''.format(columns = ', '.join(_INDEXED_COLUMNS),
+           new = ', '.join(['new.id'] + ['new.' + c for c in _INDEXED_COLUMNS]),
+           old = ', '.join(['old.id'] + ['old.' + c for c in _INDEXED_COLUMNS]))
+
+# Values that are None (such as the Caltech status of records that come from
+# TIND rather than the spreadsheet) never replace stored values.  The update
+# is skipped entirely if no value would change.  status_seen is the time at
+# which a change of the Caltech status was seen; it stays NULL for a new row,
+# because a status that was already set when the request was first seen (for
+# example, on the first run) says nothing about when it was set.
+_UPSERT = '''
+INSERT INTO requests ({columns}, first_seen, status_seen)
+    VALUES ({params}, :now, NULL)
+    ON CONFLICT ({keys}) DO UPDATE SET
+        {assignments},
+        status_seen = CASE WHEN excluded.caltech_status IS NOT NULL
+                            AND excluded.caltech_status IS NOT caltech_status
+                           THEN :now ELSE status_seen END
+    WHERE {changed};
+'''.format(columns = ', '.join(_KEY_COLUMNS + _VALUE_COLUMNS),
+           params = ', '.join(':' + c for c in _KEY_COLUMNS + _VALUE_COLUMNS),
+           keys = ', '.join(_KEY_COLUMNS),
+           assignments = ',\n        '.join(
+               '{0} = coalesce(excluded.{0}, {0})'.format(c) for c in _VALUE_COLUMNS),
+           changed = '\n       OR '.join(
+               '(excluded.{0} IS NOT NULL AND excluded.{0} IS NOT {0})'.format(c)
+               for c in _VALUE_COLUMNS))
+
+_RESULT_COLUMNS = (_KEY_COLUMNS + _VALUE_COLUMNS + ['first_seen', 'status_seen'])
+
+
+# Class definitions.
+# .............................................................................
+
+class HoldHistory():
+    '''Interface to the local database of hold requests seen by Hold It!.
+    Each thread must use its own HoldHistory object.'''
+
+    def __init__(self, file = None):
+        self._file = file or path.join(user_data_path(), _HISTORY_FILE)
+        if __debug__: log('opening history database {}', self._file)
+        self._db = sqlite3.connect(self._file, timeout = _LOCK_TIMEOUT)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            self._db.executescript(_SCHEMA)
+        try:
+            with self._db:
+                self._db.executescript(_FTS_SCHEMA)
+            self._fts = True
+        except sqlite3.OperationalError as err:
+            if __debug__: log('full-text search unavailable: {}', str(err))
+            self._fts = False
+
+
+    def add(self, records):
+        '''Adds the hold requests in 'records' to the database, or updates
+        the stored values of requests already in it.  Returns the number of
+        requests added or changed.'''
+        # Most of the records are unchanged since the last run.  Reading all
+        # the stored values at once and only writing the records that differ
+        # is much faster than an upsert for every record.
+        now = datetime.now().isoformat(' ', 'seconds')
+        stored = self._stored_values()
+        rows = [values for values in (_row_values(r, now) for r in records)
+                if _changed(values, stored)]
+        if not rows:
+            return 0
+        with self._db:
+            cursor = self._db.executemany(_UPSERT, rows)
+        changed = max(cursor.rowcount, 0)
+        if __debug__: log('history database: {} requests added or changed', changed)
+        return changed
+
+
+    def search(self, terms, limit = _SEARCH_LIMIT):
+        '''Returns a list of dictionaries for the stored requests that match
+        all of the strings in the list 'terms', best matches first.  Each
+        term matches words that begin with it.'''
+        terms = [term for term in terms if term.strip()]
+        if not terms:
+            return []
+        columns = ', '.join('requests.' + c for c in _RESULT_COLUMNS)
+        if self._fts:
+            query = ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+            sql = ('SELECT {} FROM requests_fts JOIN requests ON requests.id = requests_fts.rowid'
+                   ' WHERE requests_fts MATCH ? ORDER BY rank LIMIT ?').format(columns)
+            params = [query, limit]
+        else:
+            text = " || ' ' || ".join("coalesce({}, '')".format(c) for c in _INDEXED_COLUMNS)
+            sql = ('SELECT {} FROM requests WHERE {} ORDER BY date_requested DESC LIMIT ?'
+                   .format(columns, ' AND '.join(['({}) LIKE ?'.format(text)] * len(terms))))
+            params = ['%' + term + '%' for term in terms] + [limit]
+        return [dict(row) for row in self._db.execute(sql, params)]
+
+
+    def rows(self):
+        '''Returns an iterator over all the stored requests, as dictionaries.'''
+        sql = 'SELECT {} FROM requests'.format(', '.join(_RESULT_COLUMNS))
+        return (dict(row) for row in self._db.execute(sql))
+
+
+    def close(self):
+        self._db.close()
+
+
+    def _stored_values(self):
+        # Returns a dictionary mapping tuples of the key columns of the
+        # stored requests to tuples of their value columns.
+        sql = 'SELECT {} FROM requests'.format(', '.join(_KEY_COLUMNS + _VALUE_COLUMNS))
+        width = len(_KEY_COLUMNS)
+        return {tuple(row[:width]): tuple(row[width:]) for row in self._db.execute(sql)}
+
+
+# Miscellaneous utilities.
+# .............................................................................
+
+def _row_values(record, now):
+    values = {name: getattr(record, name, None) for name in _VALUE_COLUMNS}
+    values['item_barcode']   = record.item_barcode
+    values['requester_name'] = record.requester_name
+    # Store dates in one format, so that the same request read from TIND and
+    # from the spreadsheet ends up in the same row.
+    requested = parsed_datetime(record.date_requested)
+    if requested:
+        values['date_requested'] = requested.isoformat(' ', 'seconds')
+    else:
+        values['date_requested'] = record.date_requested.strip()
+    values['now'] = now
+    return values
+
+
+def _changed(values, stored):
+    # Mirrors the condition in _UPSERT: a request is written if it is new or
+    # if a value that is not None differs from the stored one.
+    previous = stored.get(tuple(values[name] for name in _KEY_COLUMNS))
+    if previous is None:
+        return True
+    return any(values[name] is not None and values[name] != old
+               for name, old in zip(_VALUE_COLUMNS, previous))
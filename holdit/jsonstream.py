@@ -0,0 +1,142 @@
+'''
+jsonstream.py: incremental decoding of large JSON objects
+
+The data returned by TIND's bibcirculation AJAX call is a JSON object whose
+"data" member is an array with one element per hold request.  Rather than
+reading the whole response and decoding it in one go, JsonArrayStream reads
+the response in chunks and hands out the elements of the array one at a
+time, as soon as each one has been received.  The other members of the
+object are collected along the way.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import codecs
+import json
+
+
+# Global constants.
+# .............................................................................
+
+_WHITESPACE = ' \t\n\r'
+
+_COMPACT_SIZE = 65536
+'''
+Number of consumed characters after which the input buffer is trimmed.
+'''
+
+
+# Class definitions.
+# .............................................................................
+
+class JsonArrayStream():
+    '''Iterates over the elements of the array-valued member 'array_name' of
+    a JSON object, given an iterable of byte strings containing the UTF-8
+    encoded text of the object.  The values of the other members of the
+    object are stored in the dictionary 'fields' as they are encountered;
+    members that follow the array are only available once the iteration is
+    finished.  Malformed input results in a ValueError.'''
+
+    def __init__(self, chunks, array_name):
+        self.fields = {}
+        self._array_name = array_name
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+
+    def __iter__(self):
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            name = self._value()
+            self._expect(':')
+            if name == self._array_name:
+                yield from self._array()
+            else:
+                self.fields[name] = self._value()
+            if self._next_char() == '}':
+                return
+            self._pos -= 1
+            self._expect(',')
+
+
+    def _array(self):
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self._value()
+            if self._next_char() == ']':
+                return
+            self._pos -= 1
+            self._expect(',')
+
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # A value that ends exactly at the end of the buffer may be
+                # incomplete (e.g., a number), so we need to read more.
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._fill()
+
+
+    def _peek(self):
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError('Unexpected end of JSON input')
+
+
+    def _next_char(self):
+        char = self._peek()
+        self._pos += 1
+        return char
+
+
+    def _expect(self, char):
+        found = self._next_char()
+        if found != char:
+            raise ValueError('Expected "{}" in JSON input but found "{}"'
+                             .format(char, found))
+
+
+    def _fill(self):
+        if self._pos > _COMPACT_SIZE:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        for chunk in self._chunks:
+            text = self._utf8.decode(chunk)
+            if text:
+                self._buffer += text
+                return True
+        self._buffer += self._utf8.decode(b'', final = True)
+        self._eof = True
+        return False
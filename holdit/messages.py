@@ -29,6 +29,7 @@ except:
 
 import holdit
 from holdit.exceptions import *
+from holdit.debug import save_recent_events
 
 
 # Exported classes.
@@ -75,9 +76,14 @@ class MessageHandlerCLI(MessageHandlerBase):
     def fatal(self, text, details = ''):
         '''Prints a message reporting a fatal error.  This method does not
         exit the program; it leaves that to the caller in case the caller
-        needs to perform additional tasks before exiting.
+        needs to perform additional tasks before exiting.  The recent debug
+        log events are saved to a file, whose location is printed.
         '''
         msg('FATAL: ' + text, ['error', 'bold'], self._colorize)
+        events_file = save_recent_events()
+        if events_file:
+            msg('Recent events were saved in {}'.format(events_file), 'info',
+                self._colorize)
 
 
     def yes_no(self, question):
@@ -115,8 +121,14 @@ class MessageHandlerGUI(MessageHandlerBase):
     def fatal(self, text, details = ''):
         '''Prints a message reporting a fatal error.  This method does not
         exit the program; it leaves that to the caller in case the caller
-        needs to perform additional tasks before exiting.
+        needs to perform additional tasks before exiting.  The recent debug
+        log events are saved to a file, whose location is added to the
+        details shown to the user.
         '''
+        events_file = save_recent_events()
+        if events_file:
+            details = '{}\n\nRecent events were saved in {}'.format(details or text,
+                                                                   events_file)
         wx.CallAfter(self._dialog, text, details, 'fatal')
         self._wait()
 
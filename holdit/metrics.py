@@ -0,0 +1,75 @@
+'''
+metrics.py: collection of run-time measurements for Hold It!
+
+Different parts of Hold It! record counts and durations here as the program
+runs, so that they can be reported in one place at the end of a run.  Values
+are identified by a name and optional labels, as in the following examples:
+
+    increment('http_requests')
+    set_value('preflight_up', 1, host = 'caltech.tind.io')
+    with timed('phase_seconds', phase = 'tind'):
+        ...
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+from contextlib import contextmanager
+import threading
+import time
+
+
+# Global variables.
+# .............................................................................
+
+_values = {}
+'''
+Recorded values, keyed by tuples of (name, labels), where labels is a
+sorted tuple of (label name, label value) pairs.
+'''
+
+_lock = threading.Lock()
+
+
+# Exported functions.
+# .............................................................................
+
+def increment(name, amount = 1, **labels):
+    '''Adds 'amount' to the value of the named metric.'''
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _values[key] = _values.get(key, 0) + amount
+
+
+def set_value(name, value, **labels):
+    '''Sets the value of the named metric, replacing any previous value.'''
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _values[key] = value
+
+
+@contextmanager
+def timed(name, **labels):
+    '''Context manager that adds the time spent in its body, in seconds, to
+    the value of the named metric.'''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        increment(name, time.perf_counter() - start, **labels)
+
+
+def snapshot():
+    '''Returns a copy of all recorded values, as a dictionary whose keys are
+    (name, labels) tuples.'''
+    with _lock:
+        return dict(_values)
@@ -14,12 +14,108 @@ open-source software released under a 3-clause BSD license.  Please see the
 file "LICENSE" for more information.
 '''
 
+from   concurrent.futures import ThreadPoolExecutor, wait
 import requests
+from   requests.utils import get_environ_proxies
+import socket
+import threading
+import time
+
+import holdit
+from holdit.metrics import set_value
+from holdit.debug import log
+
+
+# Global constants.
+# .............................................................................
+
+_SERVICE_HOSTS = ['caltech.tind.io', 'idp.caltech.edu', 'sheets.googleapis.com']
+'''
+The hosts that Hold It! needs to reach in order to do its work.
+'''
+
+_PROBE_TIMEOUT = 5
+'''
+Maximum time (in sec) to wait for the probes of all hosts to finish.
+'''
+
+_CACHE_TIME = 60
+'''
+How long (in sec) the result of probing a host is remembered.
+'''
+
+
+# Global variables.
+# .............................................................................
+
+_probe_results = {}
+'''
+Results of recent probes, as a dictionary of host -> (time, reachable).
+'''
+
+_probe_lock = threading.Lock()
+
+
+# Exported functions.
+# .............................................................................
 
 def network_available():
     '''Return True if it appears we have a network connection, False if not.'''
+    return all(service_status().values())
+
+
+def service_status(hosts = _SERVICE_HOSTS, timeout = _PROBE_TIMEOUT):
+    '''Checks whether the given hosts can be reached, and returns a dictionary
+    of host -> True or False.  The hosts are probed concurrently by opening
+    (and immediately closing) a connection to their HTTPS port, or, if a
+    proxy is configured for the host (e.g., using HTTPS_PROXY), by sending
+    a HEAD request through the proxy.  A host whose probe does not succeed
+    within 'timeout' seconds is reported as not reachable.  Results are
+    remembered for a short time, so that repeated calls do not probe the
+    same host again.
+    '''
+    now = time.monotonic()
+    results = {}
+    with _probe_lock:
+        for host in hosts:
+            if host in _probe_results and now - _probe_results[host][0] < _CACHE_TIME:
+                results[host] = _probe_results[host][1]
+    unknown = [host for host in hosts if host not in results]
+    if unknown:
+        if __debug__: log('probing {}', ', '.join(unknown))
+        # Don't use the executor as a context manager, because that would
+        # make us wait for probes that are stuck (e.g., in DNS lookups).
+        executor = ThreadPoolExecutor(max_workers = len(unknown))
+        futures = {executor.submit(_probe, host, timeout): host for host in unknown}
+        wait(futures, timeout = timeout)
+        executor.shutdown(wait = False)
+        with _probe_lock:
+            for future, host in futures.items():
+                reachable = future.done() and future.result()
+                _probe_results[host] = (now, reachable)
+                results[host] = reachable
+                set_value('preflight_up', int(reachable), host = host)
+    return results
+
+
+# Internal utilities.
+# .............................................................................
+
+def _probe(host, timeout):
+    start = time.perf_counter()
+    url = 'https://' + host
     try:
-        r = requests.get("https://www.google.com")
-        return True
-    except requests.ConnectionError:
-        return False
+        if get_environ_proxies(url):
+            # A direct connection may be blocked when only the proxy is
+            # allowed out.  Any HTTP response means the host can be reached.
+            requests.head(url, timeout = timeout, allow_redirects = False)
+        else:
+            socket.create_connection((host, 443), timeout = timeout).close()
+        reachable = True
+    except (OSError, requests.RequestException) as err:
+        if __debug__: log('unable to connect to {}: {}', host, err)
+        reachable = False
+    elapsed = time.perf_counter() - start
+    if __debug__: log('probe of {} took {:.0f} ms', host, elapsed * 1000)
+    set_value('preflight_seconds', elapsed, host = host)
+    return reachable
@@ -0,0 +1,61 @@
+'''
+pipeline.py: helpers for building record processing pipelines
+
+Hold It! processes records as a chain of generators (fetch, parse, filter,
+diff, and so on), so that only the records that survive to the end of the
+chain ever need to be held in memory at once.  The stage() function in this
+module wraps one link of such a chain to count the items that pass through
+it and measure the time spent producing them.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import time
+
+import holdit
+from holdit.metrics import increment
+from holdit.debug import log
+
+
+# Exported functions.
+# .............................................................................
+
+def stage(name, items, **labels):
+    '''Yields the elements of the iterable 'items' unchanged.  When the
+    iteration ends (or the generator is closed), the number of elements and
+    the time spent waiting for them are written to the debug log and added
+    to the metrics "stage_items" and "stage_seconds" with the label
+    stage = 'name' and any other labels given.  Because generators are
+    lazy, the time includes the time spent in all earlier stages of the
+    pipeline.  Stages that run at the same time in different threads (for
+    example, one per profile) should be told apart by a label, so that
+    their times are not added together.'''
+    count = 0
+    elapsed = 0
+    iterator = iter(items)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - start
+            count += 1
+            yield item
+    finally:
+        if __debug__: log('stage {} finished', name, phase = name, count = count,
+                          elapsed_ms = round(elapsed * 1000), **labels)
+        increment('stage_items', count, stage = name, **labels)
+        increment('stage_seconds', elapsed, stage = name, **labels)
@@ -15,6 +15,7 @@ file "LICENSE" for more information.
 '''
 
 import holdit
+from holdit.dates import date_key, parsed_datetime
 from holdit.debug import log
 
 
@@ -50,36 +51,85 @@ class HoldRecord(object):
 
         self.holds_count = ''                  # String
 
+
+    def as_dict(self):
+        '''Returns a dictionary of the fields of this record.'''
+        return dict(vars(self))
+
+
+    # The dates are kept as strings, exactly as they were found.  These
+    # properties give the same dates as datetime objects (or None if the
+    # string is empty or cannot be interpreted).  Parsing is cached, so
+    # using them repeatedly is cheap.
+
+    @property
+    def date_requested_dt(self):
+        return parsed_datetime(self.date_requested)
+
+
+    @property
+    def date_due_dt(self):
+        return parsed_datetime(self.date_due)
+
+
+    @property
+    def date_last_notice_sent_dt(self):
+        return parsed_datetime(self.date_last_notice_sent)
+
 
 # Utility functions.
 # .............................................................................
 
-def records_diff(known_records, new_records):
-    '''Returns the records from 'new_records' missing from 'known_records'.
-    The comparison is done on the basis of bar codes and request dates.'''
+def records_diff(known_records, new_records, archived = None):
+    '''Yields the records from 'new_records' missing from 'known_records'.
+    'known_records' must be a collection of request keys (as produced by
+    request_key()), such as the dictionary returned by records_index().
+    The comparison is done on the basis of bar codes, request dates and
+    requester names.  If 'archived' is given, it must also be a collection
+    of request keys, for records known to have been archived; any record in
+    'new_records' whose key is in 'archived' is not returned.'''
     if __debug__: log('Diffing known records with new records')
-    diffs = []
+    num_diffs = 0
     for candidate in new_records:
-        found = [record for record in known_records if same_request(record, candidate)]
-        if not found:
-            diffs.append(candidate)
-    if __debug__: log('Found {} different records', len(diffs))
-    return diffs
+        key = request_key(candidate)
+        if key in known_records or (archived and key in archived):
+            continue
+        num_diffs += 1
+        yield candidate
+    if __debug__: log('Found {} different records', num_diffs)
+
+
+def records_index(records):
+    '''Returns a dictionary mapping the request keys of the records in
+    'records' to the records.'''
+    return {request_key(record): record for record in records}
 
 
 def same_request(record1, record2):
-    return (record1.item_barcode == record2.item_barcode
-            and record1.date_requested == record2.date_requested
-            and record1.requester_name == record2.requester_name)
+    '''Returns True if the two records describe the same hold request.
+    Request dates are compared as dates, so that the same date written in
+    different formats (as TIND and Google Sheets sometimes do) matches.'''
+    return request_key(record1) == request_key(record2)
+
+
+def request_key(record):
+    '''Returns a hashable value identifying the hold request in 'record'.
+    Two records have the same key if same_request() is True for them.'''
+    return (record.item_barcode, date_key(record.date_requested),
+            record.requester_name)
 
 
-def records_filter(method = 'all'):
+def records_filter(method = 'all', locations = None):
     '''Returns a closure that takes a TindRecord and returns True or False,
     depending on whether the record should be included in the output.  This
-    is meant to be passed to Python filter() as the test function.
+    is meant to be passed to Python filter() as the test function.  If
+    'method' is 'all', all records are included.  If 'method' is
+    'location', only records whose item location code is in the list
+    'locations' are included (ignoring differences in case).
     '''
-    # FIXME. It seemed like it might be useful to provide filtering features
-    # in the future, but this is currently a no-op.
+    if method == 'location':
+        codes = set(location.lower() for location in locations)
+        return (lambda x: x.item_location_code.lower() in codes)
     return (lambda x: True)
 
 
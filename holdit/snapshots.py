@@ -0,0 +1,239 @@
+'''
+snapshots.py: remembering the hold data obtained from TIND between runs
+
+Most of the rows returned by TIND on one run are byte-for-byte identical to
+rows returned on the previous run.  TindSnapshot keeps a hash of each row of
+the last TIND pull in a compressed file in the user's data directory,
+together with the field values that were decoded from it, so that unchanged
+rows do not have to be decoded again.  Comparing the hashes of the two pulls
+also tells us which hold requests are new, which have changed and which
+are gone; this is written to a report file after every run.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+from   datetime import datetime
+import gzip
+import hashlib
+import json
+import os
+from   os import path
+from   types import SimpleNamespace
+
+import holdit
+from holdit.records import request_key
+from holdit.files import user_data_path
+from holdit.debug import log
+
+
+# Global constants.
+# .............................................................................
+
+_SNAPSHOT_FILE = 'tind-snapshot.json.gz'
+'''
+Name of the snapshot file in the user's data directory.
+'''
+
+_REPORT_FILE = 'tind-changes.txt'
+'''
+Name of the report of changes between pulls, in the user's data directory.
+'''
+
+_SUMMARY_FIELDS = ['item_barcode', 'date_requested', 'requester_name', 'item_title']
+'''
+Fields needed to compare the pulls and to write the report of changes.
+They are only decoded for rows that are not in the previous pull; for the
+other rows, they are taken from the previous snapshot.
+'''
+
+_SNAPSHOT_VERSION = 2
+'''
+Version of the snapshot file format.  Snapshots with a different version
+(for example, written by a version of Hold It! that parsed different
+fields) are ignored.
+'''
+
+
+# Class definitions.
+# .............................................................................
+
+class TindSnapshot():
+    '''The rows of the previous TIND pull and the rows of the current one.
+    Rows of the current pull are added using add() as they are received and
+    are written to a temporary file straight away, so that the pull never
+    has to be held in memory; save() replaces the previous snapshot with
+    the temporary file and writes a report of the differences.
+
+    The snapshot file is gzip-compressed JSON Lines: a header object with
+    the version and the time the snapshot was taken, followed by one object
+    per row with its hash, the values of the summary fields and the field
+    values decoded from it.'''
+
+    def __init__(self, directory = None):
+        directory = directory or user_data_path()
+        self._file = path.join(directory, _SNAPSHOT_FILE)
+        self._temp_file = self._file + '.tmp'
+        self._report_file = path.join(directory, _REPORT_FILE)
+        self._previous = {}
+        self._writer = None
+        self._failed = False
+        self._pending = None
+        self._current_hashes = set()
+        self._changed_keys = set()
+        self._count = 0
+        self._added = []
+        self._changed = []
+        self.reused = 0
+        self.taken = None
+        if path.exists(self._file):
+            try:
+                with gzip.open(self._file, 'rt', encoding = 'utf-8') as f:
+                    header = json.loads(f.readline())
+                    if header.get('version') == _SNAPSHOT_VERSION:
+                        for line in f:
+                            entry = json.loads(line)
+                            self._previous[entry['hash']] = (entry['summary'],
+                                                             entry['fields'])
+                        self.taken = header.get('taken')
+            except (OSError, ValueError, KeyError, AttributeError) as err:
+                if __debug__: log('ignoring unreadable TIND snapshot: {}', str(err))
+                self._previous = {}
+        self._previous_keys = {_key(summary): row_hash
+                               for row_hash, (summary, _) in self._previous.items()}
+        if __debug__: log('previous TIND snapshot has {} rows', len(self._previous))
+
+
+    def cached_fields(self, row_hash):
+        '''Returns the dictionary of field values decoded from the row with
+        the given hash in the previous pull, or None if there was no such
+        row.  The dictionary only holds the fields that had been decoded.'''
+        entry = self._previous.get(row_hash)
+        if entry is None:
+            return None
+        self.reused += 1
+        return entry[1]
+
+
+    def add(self, row_hash, record):
+        '''Adds a row of the current pull, given its hash and the record
+        obtained from it.  The row is written out when the next one is added
+        (or by save()), so that the fields decoded while the record went
+        through the rest of the pipeline are saved with it.'''
+        self._flush()
+        self._pending = (row_hash, record)
+
+
+    def changes(self):
+        '''Compares the rows added so far with the previous pull.  Returns a
+        dictionary with keys 'added', 'changed' and 'removed', whose values
+        are lists of dictionaries of field values.'''
+        self._flush()
+        removed = [self._previous[row_hash][0]
+                   for key, row_hash in self._previous_keys.items()
+                   if row_hash not in self._current_hashes
+                   and key not in self._changed_keys]
+        return {'added': list(self._added), 'changed': list(self._changed),
+                'removed': removed}
+
+
+    def save(self):
+        '''Makes the current pull the new snapshot and writes the report of
+        changes since the previous pull.  Returns the changes, as returned
+        by changes().'''
+        changes = self.changes()
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+            os.replace(self._temp_file, self._file)
+        with open(self._report_file, 'w', encoding = 'utf-8') as f:
+            f.write(changes_report(changes))
+        if __debug__: log('saved TIND snapshot ({} rows, {} reused); changes: {}',
+                          self._count, self.reused, changes_summary(changes))
+        return changes
+
+
+    def _flush(self):
+        # Records the pending row in the comparison with the previous pull
+        # and appends it to the temporary snapshot file.
+        if not self._pending:
+            return
+        row_hash, record = self._pending
+        self._pending = None
+        self._count += 1
+        self._current_hashes.add(row_hash)
+        if row_hash in self._previous:
+            summary = self._previous[row_hash][0]
+        else:
+            summary = {name: getattr(record, name) for name in _SUMMARY_FIELDS}
+            key = _key(summary)
+            if key in self._previous_keys:
+                self._changed.append(summary)
+                self._changed_keys.add(key)
+            else:
+                self._added.append(summary)
+        if self._failed:
+            return
+        try:
+            if not self._writer:
+                self._writer = gzip.open(self._temp_file, 'wt', encoding = 'utf-8')
+                header = {'version': _SNAPSHOT_VERSION,
+                          'taken': datetime.now().isoformat(' ', 'seconds')}
+                self._writer.write(json.dumps(header) + '\n')
+            entry = {'hash': row_hash, 'summary': summary,
+                     'fields': record.decoded_fields()}
+            self._writer.write(json.dumps(entry, separators = (',', ':')) + '\n')
+        except OSError as err:
+            # Not having a snapshot next time only costs some parsing time,
+            # so the previous snapshot is simply kept.
+            if __debug__: log('unable to write TIND snapshot: {}', str(err))
+            self._failed = True
+            if self._writer:
+                self._writer.close()
+                self._writer = None
+
+
+# Exported functions.
+# .............................................................................
+
+def row_hash(row):
+    '''Returns a hash of the contents of a row of TIND data.'''
+    text = '\x1f'.join(str(cell) for cell in row)
+    return hashlib.blake2b(text.encode('utf-8'), digest_size = 16).hexdigest()
+
+
+def changes_summary(changes):
+    '''Returns a one-line summary of the result of TindSnapshot.changes().'''
+    return '{} new, {} changed, {} gone'.format(
+        len(changes['added']), len(changes['changed']), len(changes['removed']))
+
+
+def changes_report(changes):
+    '''Returns a text report of the result of TindSnapshot.changes().'''
+    lines = ['Changes in TIND hold requests since the previous run: {}'
+             .format(changes_summary(changes))]
+    for heading, name in [('New', 'added'), ('Changed', 'changed'), ('Gone', 'removed')]:
+        if changes[name]:
+            lines.append('')
+            lines.append('{}:'.format(heading))
+            for fields in changes[name]:
+                lines.append('  {}  {}  {}  {}'.format(
+                    fields.get('date_requested', ''), fields.get('item_barcode', ''),
+                    fields.get('requester_name', ''), fields.get('item_title', '')))
+    return '\n'.join(lines) + '\n'
+
+
+# Miscellaneous utilities.
+# .............................................................................
+
+def _key(fields):
+    return request_key(SimpleNamespace(**fields))
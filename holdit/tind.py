@@ -14,14 +14,25 @@ open-source software released under a 3-clause BSD license.  Please see the
 file "LICENSE" for more information.
 '''
 
-import json
-import requests
-from lxml import html
-from bs4 import BeautifulSoup
+from   bs4 import BeautifulSoup
+from   collections import Counter, deque, namedtuple
+from   concurrent.futures import ProcessPoolExecutor
+from   functools import lru_cache
+from   html import unescape
+from   itertools import islice
+from   lxml import html
+import os
+import re
 
 import holdit
+from holdit.credentials import forget_cached_credentials
 from holdit.exceptions import *
+from holdit.jsonstream import JsonArrayStream
+from holdit.metrics import increment
+from holdit.pipeline import stage
 from holdit.records import HoldRecord
+from holdit.snapshots import TindSnapshot, row_hash, changes_summary
+from holdit.transport import new_session
 from holdit.debug import log
 
 
@@ -45,113 +56,580 @@ _SSO_URL = 'https://idp.caltech.edu/idp/profile/SAML2/Redirect/SSO'
 Root URL for the Caltech SAML steps.
 '''
 
+_AJAX_URL = 'https://caltech.tind.io/admin2/bibcirculation/requests?draw=1&order%5B0%5D%5Bdir%5D=asc&start={start}&length={length}&search%5Bvalue%5D=&search%5Bregex%5D=false&sort=request_date&sort_dir=asc'
+'''
+URL of the AJAX call that returns the hold data.  The arguments are the
+index of the first row to return and the number of rows.
+'''
+
+_CHUNK_SIZE = 16384
+'''
+Number of bytes read at a time from the response to the AJAX call.
+'''
+
+_PARSE_CACHE_SIZE = 4096
+'''
+Maximum number of distinct HTML fragments whose parsed values are kept for
+each column of TIND data.
+'''
+
+_PARALLEL_CHUNK_SIZE = 200
+'''
+Number of rows of TIND data handed to a worker process at a time, when the
+rows are parsed in parallel.
+'''
+
+_FIELDS = ['requester_url', 'requester_name', 'requester_type',
+           'item_details_url', 'item_title', 'date_due', 'overdue_notices_count',
+           'item_loan_url', 'item_loan_status', 'item_record_url', 'item_barcode',
+           'item_call_number', 'date_requested', 'date_last_notice_sent',
+           'holds_count', 'item_location_name', 'item_location_code']
+'''
+Names of the fields of TindRecord that are obtained by parsing TIND data.
+'''
+
 
+# Global variables.
+# .............................................................................
+
+_settings = {
+    'client'             : 'requests',  # "requests" or "asyncio".
+    'max_rows'           : 1000,        # Rows asked for (requests only).
+    'page_size'          : 500,         # Rows per AJAX call (asyncio only).
+    'concurrency'        : 4,           # Max. AJAX calls at once (asyncio only).
+    'parallel_threshold' : 20000,       # Rows above which parsing uses processes.
+}
+'''
+Settings for getting and parsing the TIND data.  These can be changed using
+configure().
+'''
+
+_session = None
+'''
+The requests session that was last logged in to TIND.  It is kept so that
+other pages (such as item details) can be fetched without logging in again.
+'''
+
+
 # Class definitions.
 # .............................................................................
 
 class TindRecord(HoldRecord):
-    '''Class to store structured representations of a TIND hold request.'''
+    '''Class to store structured representations of a TIND hold request.
+
+    The fields are decoded from the raw TIND data only when they are first
+    used, one column at a time, and then remembered.  Most records are only
+    looked at to check their status and to compare them with the records in
+    the spreadsheet, so most columns of most rows are never decoded.
+    '''
 
     def __init__(self, json_record):
         '''json_record = single 'data' record from the raw json returned by
         the TIND.io ajax call.
         '''
-        super().__init__()
+        # HoldRecord.__init__() is not called, because it would set all the
+        # fields to empty values and __getattr__() would never be called.
         self.raw_json = json_record
-        self.parse_requester_details(json_record)
-        self.parse_item_details(json_record)
-
-
-    def parse_requester_details(self, json_record):
-        relevant_fragment = json_record[0]
-        soup = BeautifulSoup(relevant_fragment, features='lxml')
-        self.requester_url = soup.a['href']
-        self.requester_name = soup.a.get_text().strip()
-        self.requester_type = soup.body.small.get_text().strip()
-
-
-    def parse_item_details(self, json_record):
-        relevant_fragment = json_record[1]
-        soup = BeautifulSoup(relevant_fragment, features='lxml')
-        self.item_details_url = soup.body.a['href']
-        self.item_title = soup.body.a.get_text().strip()
-
-        if soup.body.small.find('i'):
-            due_string = soup.body.small.i['data-original-title']
-            if 'Due date' in due_string:
-                start = due_string.find(': ')
-                end = due_string.find('\n')
-                self.date_due = due_string[start + 2 : end]
-            if 'Overdue letters' in due_string:
-                start = due_string.find('Overdue letters sent: ')
-                self.overdue_notices_count = due_string[start + 22 :]
-
-            self.item_loan_url = soup.body.small.a['href']
-            self.item_loan_status = soup.body.small.a.get_text().lower().strip()
-        elif 'lost' in str(soup.body.small).lower():
-            self.item_loan_status = 'lost'
-        elif 'on hold' in str(soup.body.small).lower():
-            self.item_loan_status = 'on hold'
-        elif 'on shelf' in str(soup.body.small).lower():
-            self.item_loan_status = 'on shelf'
-
-        relevant_fragment = json_record[2]
-        soup = BeautifulSoup(relevant_fragment, features='lxml')
-        self.item_record_url = soup.body.a['href']
-        self.item_barcode = soup.body.a.get_text().strip()
-        spans = soup.body.find_all('span')
-        self.item_call_number = spans[1].get_text().strip()
-
-        relevant_fragment = json_record[3]
-        soup = BeautifulSoup(relevant_fragment, features='lxml')
-        self.date_requested = soup.body.span.get_text().strip()
-
-        relevant_fragment = json_record[4]
-        soup = BeautifulSoup(relevant_fragment, features='lxml')
-        self.date_last_notice_sent = soup.span['data-original-title']
-        self.overdue_notices_count = soup.span.get_text().strip()
-
-        relevant_fragment = json_record[5]
-        soup = BeautifulSoup(relevant_fragment, features='lxml')
-        self.holds_count = soup.body.p.get_text().strip()
-
-        relevant_fragment = json_record[6]
-        soup = BeautifulSoup(relevant_fragment, features='lxml')
-        self.item_location_name = soup.body.span['data-original-title']
-        self.item_location_code = soup.body.span.get_text().strip()
 
-
+
+    def __getattr__(self, name):
+        # Only called for attributes that have not been set yet.
+        if name not in _FIELD_COLUMNS:
+            raise AttributeError(name)
+        column, names, extractor = _FIELD_COLUMNS[name]
+        for field, value in zip(names, extractor(self.raw_json[column])):
+            setattr(self, field, value)
+        return self.__dict__[name]
+
+
+    @classmethod
+    def from_fields(cls, json_record, fields):
+        '''Returns a TindRecord for 'json_record' whose field values are
+        taken from the dictionary 'fields' (as returned by parsed_fields()
+        or decoded_fields() for an identical row) instead of being parsed
+        again.  Fields missing from 'fields' are decoded when needed.'''
+        record = cls(json_record)
+        for name, value in fields.items():
+            setattr(record, name, value)
+        return record
+
+
+    def parsed_fields(self):
+        '''Returns a dictionary of the values of the fields of this record
+        that were obtained by parsing TIND data.  All the fields are decoded
+        if they have not been already.'''
+        return {name: getattr(self, name) for name in _FIELDS}
+
+
+    def decoded_fields(self):
+        '''Returns a dictionary of the values of the fields of this record
+        that have been decoded so far.'''
+        return {name: value for name, value in vars(self).items() if name in _FIELD_COLUMNS}
+
+
+    def as_dict(self):
+        '''Returns a dictionary of all the fields of this record.'''
+        self.parsed_fields()
+        return super().as_dict()
+
+
+# Field extraction.
+# .............................................................................
+# The HTML fragments in the columns of a row of TIND data are small and very
+# regular.  For each column there are two functions that take the fragment
+# and return a tuple of the values of the fields found in it: a fast one that
+# scans the text with regular expressions, and a slow one that uses a full
+# HTML parser.  The fast function returns None if the fragment is not in the
+# form it expects (e.g., because TIND changed its markup), in which case the
+# slow function is used instead and the fallback is counted.
+#
+# The same fragments occur over and over (e.g., the location of an item, or
+# the requester details of someone with several holds), so the results are
+# also cached.  The caches are bounded because a long-running process could
+# otherwise accumulate every fragment it has ever seen.
+
+_Element = namedtuple('_Element', 'attributes text html end')
+
+_ATTRIBUTE_REGEX = {}
+_OPEN_TAG_REGEX = {}
+_CLOSE_TAG_REGEX = {}
+
+for _tag in ['a', 'i', 'p', 'small', 'span']:
+    _OPEN_TAG_REGEX[_tag] = re.compile(r'<{}(\s[^<>]*)?>'.format(_tag), re.IGNORECASE)
+    _CLOSE_TAG_REGEX[_tag] = re.compile(r'</{}\s*>'.format(_tag), re.IGNORECASE)
+
+for _name in ['href', 'data-original-title']:
+    _ATTRIBUTE_REGEX[_name] = re.compile(r'\s{}\s*=\s*"([^"]*)"'.format(_name),
+                                         re.IGNORECASE)
+
+_fallback_counts = Counter()
+'''
+Number of fragments in each column that could not be handled by the fast
+extraction functions.
+'''
+
+
+def _element(fragment, tag, start = 0, plain = True):
+    '''Finds the first element 'tag' in 'fragment' at or after position
+    'start'.  Returns an _Element, or None if there is no such element or
+    (when 'plain' is True) if the element's content contains markup.  The
+    text of the element has HTML entities decoded.'''
+    opening = _OPEN_TAG_REGEX[tag].search(fragment, start)
+    if not opening:
+        return None
+    closing = _CLOSE_TAG_REGEX[tag].search(fragment, opening.end())
+    if not closing:
+        return None
+    content = fragment[opening.end() : closing.start()]
+    if plain and '<' in content:
+        return None
+    return _Element(opening.group(1) or '', unescape(content),
+                    fragment[opening.start() : closing.end()], closing.end())
+
+
+def _attribute(element, name):
+    '''Returns the value of attribute 'name' of 'element', or None.'''
+    match = _ATTRIBUTE_REGEX[name].search(element.attributes)
+    return unescape(match.group(1)) if match else None
+
+
+def _requester_fast(fragment):
+    a = _element(fragment, 'a')
+    small = _element(fragment, 'small')
+    if not a or not small or _attribute(a, 'href') is None:
+        return None
+    return (_attribute(a, 'href'), a.text.strip(), small.text.strip())
+
+
+def _requester_soup(fragment):
+    soup = BeautifulSoup(fragment, features='lxml')
+    return (soup.a['href'], soup.a.get_text().strip(),
+            soup.body.small.get_text().strip())
+
+
+def _item_fast(fragment):
+    a = _element(fragment, 'a')
+    if not a or _attribute(a, 'href') is None:
+        return None
+    small = _element(fragment, 'small', a.end, plain = False)
+    if not small:
+        return None
+    date_due = loan_url = loan_status = ''
+    if _OPEN_TAG_REGEX['i'].search(small.html):
+        i = _element(small.html, 'i')
+        loan = _element(small.html, 'a')
+        if not i or not loan:
+            return None
+        due_string = _attribute(i, 'data-original-title')
+        loan_url = _attribute(loan, 'href')
+        if due_string is None or loan_url is None:
+            return None
+        if 'Due date' in due_string:
+            start = due_string.find(': ')
+            end = due_string.find('\n')
+            date_due = due_string[start + 2 : end]
+        loan_status = loan.text.lower().strip()
+    elif 'lost' in small.html.lower():
+        loan_status = 'lost'
+    elif 'on hold' in small.html.lower():
+        loan_status = 'on hold'
+    elif 'on shelf' in small.html.lower():
+        loan_status = 'on shelf'
+    return (_attribute(a, 'href'), a.text.strip(), date_due, loan_url, loan_status)
+
+
+def _item_soup(fragment):
+    soup = BeautifulSoup(fragment, features='lxml')
+    details_url = soup.body.a['href']
+    title = soup.body.a.get_text().strip()
+    date_due = loan_url = loan_status = ''
+    if soup.body.small.find('i'):
+        due_string = soup.body.small.i['data-original-title']
+        if 'Due date' in due_string:
+            start = due_string.find(': ')
+            end = due_string.find('\n')
+            date_due = due_string[start + 2 : end]
+        loan_url = soup.body.small.a['href']
+        loan_status = soup.body.small.a.get_text().lower().strip()
+    elif 'lost' in str(soup.body.small).lower():
+        loan_status = 'lost'
+    elif 'on hold' in str(soup.body.small).lower():
+        loan_status = 'on hold'
+    elif 'on shelf' in str(soup.body.small).lower():
+        loan_status = 'on shelf'
+    return (details_url, title, date_due, loan_url, loan_status)
+
+
+def _barcode_fast(fragment):
+    a = _element(fragment, 'a')
+    if not a or _attribute(a, 'href') is None:
+        return None
+    # The call number is in the second span.  Every span up to that one must
+    # be plain, or we might miscount.
+    first = _element(fragment, 'span')
+    second = first and _element(fragment, 'span', first.end)
+    if not second or fragment.lower().count('<span', 0, second.end) != 2:
+        return None
+    return (_attribute(a, 'href'), a.text.strip(), second.text.strip())
+
+
+def _barcode_soup(fragment):
+    soup = BeautifulSoup(fragment, features='lxml')
+    spans = soup.body.find_all('span')
+    return (soup.body.a['href'], soup.body.a.get_text().strip(),
+            spans[1].get_text().strip())
+
+
+def _date_requested_fast(fragment):
+    span = _element(fragment, 'span')
+    if not span:
+        return None
+    return (span.text.strip(),)
+
+
+def _date_requested_soup(fragment):
+    soup = BeautifulSoup(fragment, features='lxml')
+    return (soup.body.span.get_text().strip(),)
+
+
+def _notice_fast(fragment):
+    span = _element(fragment, 'span')
+    if not span or _attribute(span, 'data-original-title') is None:
+        return None
+    return (_attribute(span, 'data-original-title'), span.text.strip())
+
+
+def _notice_soup(fragment):
+    soup = BeautifulSoup(fragment, features='lxml')
+    return (soup.span['data-original-title'], soup.span.get_text().strip())
+
+
+def _holds_count_fast(fragment):
+    p = _element(fragment, 'p')
+    if not p:
+        return None
+    return (p.text.strip(),)
+
+
+def _holds_count_soup(fragment):
+    soup = BeautifulSoup(fragment, features='lxml')
+    return (soup.body.p.get_text().strip(),)
+
+
+def _location_fast(fragment):
+    span = _element(fragment, 'span')
+    if not span or _attribute(span, 'data-original-title') is None:
+        return None
+    return (_attribute(span, 'data-original-title'), span.text.strip())
+
+
+def _location_soup(fragment):
+    soup = BeautifulSoup(fragment, features='lxml')
+    return (soup.body.span['data-original-title'], soup.body.span.get_text().strip())
+
+
+def _extractor(column, fast, slow):
+    '''Returns a cached function that extracts the field values from the
+    fragments of the given column using 'fast', or 'slow' if 'fast' fails.'''
+    @lru_cache(maxsize = _PARSE_CACHE_SIZE)
+    def extract(fragment):
+        values = fast(fragment)
+        if values is None:
+            _fallback_counts[column] += 1
+            increment('tind_parse_fallbacks', column = column)
+            if __debug__: log('column {} fragment not recognized: {}', column, fragment)
+            values = slow(fragment)
+        return values
+    return extract
+
+
+_COLUMNS = [
+    (0, ['requester_url', 'requester_name', 'requester_type'],
+     _extractor(0, _requester_fast, _requester_soup)),
+    (1, ['item_details_url', 'item_title', 'date_due', 'item_loan_url',
+         'item_loan_status'],
+     _extractor(1, _item_fast, _item_soup)),
+    (2, ['item_record_url', 'item_barcode', 'item_call_number'],
+     _extractor(2, _barcode_fast, _barcode_soup)),
+    (3, ['date_requested'],
+     _extractor(3, _date_requested_fast, _date_requested_soup)),
+    (4, ['date_last_notice_sent', 'overdue_notices_count'],
+     _extractor(4, _notice_fast, _notice_soup)),
+    (5, ['holds_count'],
+     _extractor(5, _holds_count_fast, _holds_count_soup)),
+    (6, ['item_location_name', 'item_location_code'],
+     _extractor(6, _location_fast, _location_soup)),
+]
+'''
+The columns of a row of TIND data, the names of the TindRecord fields whose
+values are found in each column, and the function that extracts them.
+'''
+
+_FIELD_COLUMNS = {name: entry for entry in _COLUMNS for name in entry[1]}
+'''
+Dictionary mapping the names of TindRecord fields to their entries in
+_COLUMNS.
+'''
+
+
+def _log_parse_cache_stats():
+    for column, _, extractor in _COLUMNS:
+        info = extractor.cache_info()
+        log('parse cache for column {}: {} hits, {} misses, {} entries, {} fallbacks',
+            column, info.hits, info.misses, info.currsize, _fallback_counts[column])
+
+
 # Login code.
 # .............................................................................
 
+def configure(**settings):
+    '''Changes the settings used for getting and parsing TIND data.
+    Recognized keyword arguments are client, max_rows, page_size,
+    concurrency and parallel_threshold.  max_rows is the number of rows
+    asked for in the single AJAX call made by the "requests" client;
+    page_size and concurrency only apply to the "asyncio" client.
+    parallel_threshold applies to both, but the "requests" client can only
+    reach it if max_rows is larger.'''
+    for name, value in settings.items():
+        if name not in _settings:
+            raise ValueError('Unrecognized TIND setting "{}"'.format(name))
+        if value is not None:
+            _settings[name] = type(_settings[name])(value)
+    if __debug__: log('TIND settings: {}', _settings)
+
+
+def tind_session():
+    '''Returns a requests session logged in to TIND, or None if there has
+    been no successful login.'''
+    return _session
+
+
+def remember_session(session):
+    '''Makes 'session' the session returned by tind_session().'''
+    global _session
+    _session = session
+
+
 def records_from_tind(access_handler, notifier, tracer):
+    '''Logs in to TIND and returns a generator of TindRecord objects for
+    all the hold requests, whatever their status (see on_shelf_or_lost()
+    for selecting the ones that can be new).  The login happens
+    immediately, but the data is only parsed as the caller iterates over
+    the generator.  With the "requests" client, the data is also requested
+    and read as the caller iterates; with the "asyncio" client, all the
+    data is read first, in pages fetched concurrently.'''
     if __debug__: log('Starting procedure for connecting to tind.io')
-    json_data = tind_json(access_handler, notifier, tracer)
+    json_data = None
+    if _settings['client'] == 'asyncio':
+        # Imported here because tind_async uses definitions from this module.
+        from holdit.tind_async import available, tind_json_async
+        if available():
+            json_data = tind_json_async(access_handler, notifier, tracer,
+                                        _settings['page_size'], _settings['concurrency'])
+        else:
+            if __debug__: log('aiohttp is not installed; using requests')
+            json_data = tind_json(access_handler, notifier, tracer)
+    else:
+        json_data = tind_json(access_handler, notifier, tracer)
     if not json_data:
-        return []
-    records_data = json_data['recordsTotal']
-    if records_data:
-        num_records = records_data[0][0]
-        if num_records < 1:
-            return []
-    if __debug__: log('Got {} records from tind.io', num_records)
-    records = []
-    for json_record in json_data['data']:
-        tr = TindRecord(json_record)
-        # Special hack: the way the holds are being done with Tind, we only
-        # need to retrieve the new holds that are marked "on shelf" or "lost".
+        return iter([])
+    records = tind_records(json_data, notifier, TindSnapshot(),
+                           _settings['parallel_threshold'])
+    return stage('tind', records)
+
+
+def tind_records(json_data, notifier, snapshot = None, parallel_threshold = None):
+    '''Yields a TindRecord for every row in 'json_data', as returned by
+    tind_json().  The rows are parsed as they arrive from TIND, so that we
+    never need to hold the complete response in memory.  If 'snapshot' is
+    given, it must be a TindSnapshot; rows that are identical to rows in the
+    previous snapshot are not parsed again, and the snapshot is updated
+    once all the rows have been received.  If 'parallel_threshold' is given
+    and there are more rows than that, the rows are parsed in a pool of
+    processes; the records are still produced in the original order.  (With
+    the "requests" client, TIND returns at most max_rows rows, so the
+    threshold only matters if max_rows is larger than it.)'''
+    num_records = 0
+    rows = tind_rows(json_data, notifier)
+    for json_record, digest, fields in _row_fields(json_data, rows, snapshot,
+                                                   parallel_threshold):
+        num_records += 1
+        if fields:
+            record = TindRecord.from_fields(json_record, fields)
+        else:
+            record = TindRecord(json_record)
+        if snapshot:
+            snapshot.add(digest, record)
+        yield record
+    if __debug__:
+        log('Got {} records from tind.io', num_records, phase = 'tind', count = num_records)
+        _log_parse_cache_stats()
+    if 'recordsTotal' not in json_data.fields:
+        details = 'Could not find a "recordsTotal" field in returned data'
+        notifier.fatal('Caltech.tind.io return results that we could not intepret', details)
+        raise ServiceFailure(details)
+    records_total = _records_total(json_data)
+    if records_total != num_records:
+        details = 'TIND "recordsTotal" value = {} but we only got {} records'.format(
+            records_total, num_records)
+        notifier.fatal('Failed to get complete list of records from TIND', details)
+        raise InternalError(details)
+    if snapshot:
+        try:
+            changes = snapshot.save()
+            increment('tind_rows_reused', snapshot.reused)
+            if __debug__: log('TIND changes since last run: {}', changes_summary(changes))
+        except OSError as err:
+            # Not having a snapshot next time only costs some parsing time.
+            if __debug__: log('unable to save TIND snapshot: {}', str(err))
+
+
+def _row_fields(json_data, rows, snapshot, parallel_threshold):
+    # Yields a tuple (row, hash, fields) for every row in 'rows'.  'fields'
+    # is a dictionary of field values if they are already known, and None if
+    # the row still has to be parsed.  The hash is None if there is no
+    # snapshot.  Once it is clear that there are more rows than the
+    # threshold, the rest are parsed in other processes.
+    count = 0
+    for row in rows:
+        count += 1
+        digest = row_hash(row) if snapshot else None
+        yield row, digest, (snapshot.cached_fields(digest) if snapshot else None)
+        if parallel_threshold and max(count, _records_total(json_data)) > parallel_threshold:
+            yield from _parallel_row_fields(rows, snapshot)
+            return
+
+
+def _parallel_row_fields(rows, snapshot):
+    # Like _row_fields(), except that the rows are grouped in chunks and the
+    # chunks are parsed in a process pool.  The workers return tuples of
+    # field values rather than TindRecord objects, to keep what has to be
+    # sent between processes small.  Only a few chunks are in flight at any
+    # time, so that we still don't read the whole response at once.
+    # (Parse cache and fallback statistics from the workers are not kept.)
+    workers = os.cpu_count() or 1
+    if __debug__: log('parsing TIND rows using {} processes', workers)
+    pending = deque()
+
+    def finished(entries, future):
+        values = iter(future.result()) if future else iter([])
+        for row, digest, fields in entries:
+            if fields is None:
+                fields = dict(zip(_FIELDS, next(values)))
+            yield row, digest, fields
+
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        while True:
+            chunk = list(islice(rows, _PARALLEL_CHUNK_SIZE))
+            if not chunk:
+                break
+            entries = []
+            for row in chunk:
+                digest = row_hash(row) if snapshot else None
+                entries.append((row, digest, snapshot.cached_fields(digest) if snapshot else None))
+            unparsed = [row for row, _, fields in entries if fields is None]
+            future = executor.submit(_parsed_values, unparsed) if unparsed else None
+            pending.append((entries, future))
+            if len(pending) > 2 * workers:
+                yield from finished(*pending.popleft())
+        while pending:
+            yield from finished(*pending.popleft())
+
+
+def _parsed_values(rows):
+    # Runs in the worker processes.  Returns a list with a tuple of field
+    # values, in the order of _FIELDS, for every row in 'rows'.
+    results = []
+    for row in rows:
+        values = {}
+        for column, names, extractor in _COLUMNS:
+            values.update(zip(names, extractor(row[column])))
+        results.append(tuple(values[name] for name in _FIELDS))
+    return results
+
+
+def _records_total(json_data):
+    # TIND normally sends recordsTotal before the data, so we usually know
+    # the number of rows before the first one arrives.
+    records_data = json_data.fields.get('recordsTotal')
+    return records_data[0][0] if records_data else 0
+
+
+def on_shelf_or_lost(records):
+    '''Yields the records from 'records' whose status is "on shelf" or "lost".'''
+    # Special hack: the way the holds are being done with Tind, we only
+    # need to retrieve the new holds that are marked "on shelf" or "lost".
+    for tr in records:
         if 'on shelf' in tr.item_loan_status or 'lost' in tr.item_loan_status:
-            records.append(tr)
-    if __debug__: log('Returning {} "on shelf" records', len(records))
-    return records
+            yield tr
+
+
+def tind_rows(json_data, notifier):
+    '''Yields the rows of hold data from 'json_data', as returned by
+    tind_json().  Problems reading or decoding the data are reported using
+    'notifier' and result in a ServiceFailure exception.'''
+    try:
+        yield from json_data
+    except ServiceFailure:
+        # Already reported when the AJAX call failed.
+        raise
+    except Exception as err:
+        details = 'exception reading data from tind.io: {}'.format(err)
+        notifier.fatal('Unable to get data from Caltech.tind.io circulation page', details)
+        raise ServiceFailure(details)
 
 
 def tind_json(access_handler, notifier, tracer):
+    '''Logs in to TIND and returns a JsonArrayStream that yields the rows of
+    the "data" array of the result of the AJAX call that returns the holds
+    data, or None if the user did not supply login credentials.  The AJAX
+    call is made when the caller starts iterating over the stream, and the
+    rows are yielded as they are received.'''
     # Loop the login part in case the user enters the wrong password.
     logged_in = False
     while not logged_in:
         # Create a blank session and hack the user agent string.
-        session = requests.Session()
+        session = new_session()
         session.headers.update( { 'user-agent': _USER_AGENT_STRING } )
 
         # Start with the full destination path + Shibboleth login component.
@@ -200,9 +678,12 @@ def tind_json(access_handler, notifier, tracer):
             raise ServiceFailure(details)
 
         logged_in = bool(str(res.content).find('Forgot your password') <= 0)
-        if not logged_in and not notifier.yes_no('Incorrect login. Try again?'):
-            if __debug__: log('user cancelled access login')
-            raise UserCancelled
+        if not logged_in:
+            # The cached keyring values may be the cause of the failure.
+            forget_cached_credentials()
+            if not notifier.yes_no('Incorrect login. Try again?'):
+                if __debug__: log('user cancelled access login')
+                raise UserCancelled
 
     # Extract the SAML data and follow through with the action url.
     # This is needed to get the necessary cookies into the session object.
@@ -228,6 +709,7 @@ def tind_json(access_handler, notifier, tracer):
         details = 'tind.io action post returned status {}'.format(res.status_code)
         notifier.fatal('Caltech.tind.io circulation page failed to respond', details)
         raise ServiceFailure(details)
+    remember_session(session)
 
     # At this point, the session object has Invenio session cookies and
     # Shibboleth IDP session data.  We also have the TIND page we want,
@@ -237,35 +719,37 @@ def tind_json(access_handler, notifier, tracer):
     # used by TIND's javascript (in their bibcirculation.js) to fill in
     # the table.  I found this gnarly URL by studying the network
     # requests made by the page when it's loaded.
-
-    ajax_url = 'https://caltech.tind.io/admin2/bibcirculation/requests?draw=1&order%5B0%5D%5Bdir%5D=asc&start=0&length=1000&search%5Bvalue%5D=&search%5Bregex%5D=false&sort=request_date&sort_dir=asc'
+    #
+    # The body is decoded incrementally as the caller iterates over it.  The
+    # call itself is only made when the caller starts iterating, because a
+    # streamed response left unread (e.g., while the caller reads the Google
+    # spreadsheet) can be cut off by the server.
+    return JsonArrayStream(_ajax_content(session, notifier), 'data')
+
+
+def _ajax_content(session, notifier):
+    # Issues the AJAX call that returns the hold data, and yields the body
+    # of the response in chunks as they are received.
+    ajax_url = _AJAX_URL.format(start = 0, length = _settings['max_rows'])
     ajax_headers = {"X-Requested-With": "XMLHttpRequest",
                     "User-Agent": _USER_AGENT_STRING}
     try:
         if __debug__: log('Issuing ajax call to tind.io')
-        res = session.get(ajax_url, headers = ajax_headers)
+        res = session.get(ajax_url, headers = ajax_headers, stream = True)
         if __debug__: log('Succeeded in issuing ajax call to tind.io')
     except Exception as err:
         details = 'exception connecting to tind.io bibcirculation page {}'.format(err)
         notifier.fatal('Unable to get data from Caltech.tind.io circulation page', details)
         raise ServiceFailure(details)
     if res.status_code != 200:
+        res.close()
         details = 'tind.io ajax get returned status {}'.format(res.status_code)
         notifier.fatal('Caltech.tind.io failed to return hold data', details)
         raise ServiceFailure(details)
-    decoded = res.content.decode('utf-8')
-    json_data = json.loads(decoded)
-    if 'recordsTotal' not in json_data:
-        details = 'Could not find a "recordsTotal" field in returned data'
-        notifier.fatal('Caltech.tind.io return results that we could not intepret', details)
-        raise ServiceFailure(details)
-    records_total = json_data['recordsTotal'][0][0]
-    if records_total != len(json_data['data']):
-        details = 'TIND "recordsTotal" value = {} but we only got {} records'.format(
-            records_total, len(json_data['data']))
-        notifier.fatal('Failed to get complete list of records from TIND', details)
-        raise InternalError(details)
-    return json_data
+    try:
+        yield from res.iter_content(_CHUNK_SIZE)
+    finally:
+        res.close()
 
 
 def sso_login_data(user, pswd):
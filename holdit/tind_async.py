@@ -0,0 +1,254 @@
+'''
+tind_async.py: asyncio-based client for getting hold data from TIND
+
+This is an alternative to the requests-based code in tind.py.  It performs
+the same steps (the Shibboleth GET, the two IdP posts, the SAML post and the
+AJAX call), but it gets the hold data in pages of a fixed size, and once
+the first page has told us how many requests there are, all the other
+pages are fetched at the same time.  A semaphore limits the number of
+pages in flight.  The time taken to get the data then depends on the
+slowest page rather than on the number of pages.
+
+The client uses aiohttp, which is optional; available() tells whether it
+can be used.  tind_json_async() is a synchronous wrapper that runs the
+client in an event loop of its own, so that it can be called from the
+MainBody thread like tind_json().
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import asyncio
+import json
+from   lxml import html
+import time
+from   urllib.parse import urlsplit
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+import holdit
+from holdit.credentials import forget_cached_credentials
+from holdit.exceptions import *
+from holdit.metrics import increment
+from holdit.tind import _AJAX_URL, _SHIBBED_HOLD_URL, _SSO_URL, _USER_AGENT_STRING
+from holdit.tind import sso_login_data, remember_session
+from holdit.transport import settings as transport_settings, new_session
+from holdit.debug import log
+
+
+# Global constants.
+# .............................................................................
+
+_RETRY_STATUSES = [500, 502, 503, 504]
+'''
+HTTP status codes that are considered transient and cause a GET to be
+retried.  (The same as used by transport.py.)
+'''
+
+
+# Class definitions.
+# .............................................................................
+
+class PagedData():
+    '''The rows of TIND hold data obtained in pages, together with the other
+    members of the AJAX result.  This has the same interface as the
+    JsonArrayStream returned by tind.tind_json(): iterating over it yields
+    the rows, and 'fields' is a dictionary of the other members.'''
+
+    def __init__(self, rows, fields):
+        self.fields = fields
+        self._rows = rows
+
+
+    def __iter__(self):
+        return iter(self._rows)
+
+
+# Exported functions.
+# .............................................................................
+
+def available():
+    '''Returns True if the asyncio client can be used.'''
+    return aiohttp is not None
+
+
+def tind_json_async(access_handler, notifier, tracer, page_size, concurrency):
+    '''Logs in to TIND and gets the hold data, fetching up to 'concurrency'
+    pages of 'page_size' rows at a time.  Returns a PagedData object, or
+    None if the user did not supply login credentials.  This function
+    blocks until all the data has been received.'''
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(
+            _tind_data(access_handler, notifier, tracer, page_size, concurrency))
+    finally:
+        loop.close()
+
+
+# Internal coroutines.
+# .............................................................................
+
+async def _tind_data(access_handler, notifier, tracer, page_size, concurrency):
+    settings = transport_settings()
+    timeout = aiohttp.ClientTimeout(sock_connect = settings['connect_timeout'],
+                                    sock_read = settings['read_timeout'])
+    connector = aiohttp.TCPConnector(limit_per_host = settings['pool_size'])
+    headers = {'User-Agent': _USER_AGENT_STRING}
+    async with aiohttp.ClientSession(timeout = timeout, connector = connector,
+                                     headers = headers) as session:
+        if not await _login(session, access_handler, notifier, tracer):
+            return None
+        remember_session(_requests_session(session))
+        return await _pages(session, notifier, page_size, concurrency)
+
+
+async def _login(session, access_handler, notifier, tracer):
+    # Loop the login part in case the user enters the wrong password.
+    while True:
+        if __debug__: log('Issuing network get to tind.io shibboleth URL')
+        status, _ = await _request(session, 'GET', _SHIBBED_HOLD_URL, notifier,
+                                   'Failed to connect to tind.io -- try again later')
+        if status >= 300:
+            details = 'tind.io shib request returned status {}'.format(status)
+            notifier.fatal('Unexpected network result -- please inform developers', details)
+            raise ServiceFailure(details)
+
+        user, pswd, cancelled = access_handler.name_and_password()
+        if cancelled:
+            if __debug__: log('user cancelled out of login dialog')
+            raise UserCancelled
+        if not user or not pswd:
+            if __debug__: log('empty values returned from login dialog')
+            return False
+        sessionid = _cookie(session, 'JSESSIONID')
+        login_data = sso_login_data(user, pswd)
+        for step in ['e1s1', 'e1s2']:
+            next_url = '{};jsessionid={}?execution={}'.format(_SSO_URL, sessionid, step)
+            if __debug__: log('Issuing network post to idp.caltech.edu')
+            _, content = await _request(session, 'POST', next_url, notifier,
+                                        'Failed to connect to tind.io', data = login_data)
+        if b'Forgot your password' not in content:
+            break
+        # The cached keyring values may be the cause of the failure.
+        forget_cached_credentials()
+        if not notifier.yes_no('Incorrect login. Try again?'):
+            if __debug__: log('user cancelled access login')
+            raise UserCancelled
+
+    # Extract the SAML data and follow through with the action url.
+    tracer.update('Extracting data from TIND')
+    tree = html.fromstring(content)
+    forms = tree.xpath('//form[@action]')
+    if not forms:
+        details = 'Caltech Shib access result does not have expected form'
+        notifier.fatal('Unexpected network result -- please inform developers', details)
+        raise ServiceFailure(details)
+    saml_payload = {'SAMLResponse': tree.xpath('//input[@name="SAMLResponse"]')[0].value,
+                    'RelayState': tree.xpath('//input[@name="RelayState"]')[0].value}
+    if __debug__: log('Issuing network post to {}', forms[0].action)
+    status, _ = await _request(session, 'POST', forms[0].action, notifier,
+                               'Unexpected network problem -- try again later',
+                               data = saml_payload)
+    if status != 200:
+        details = 'tind.io action post returned status {}'.format(status)
+        notifier.fatal('Caltech.tind.io circulation page failed to respond', details)
+        raise ServiceFailure(details)
+    return True
+
+
+async def _pages(session, notifier, page_size, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def page(start):
+        async with semaphore:
+            url = _AJAX_URL.format(start = start, length = page_size)
+            if __debug__: log('Issuing ajax call to tind.io for rows from {}', start)
+            status, content = await _request(
+                session, 'GET', url, notifier,
+                'Unable to get data from Caltech.tind.io circulation page',
+                headers = {'X-Requested-With': 'XMLHttpRequest'})
+            if status != 200:
+                details = 'tind.io ajax get returned status {}'.format(status)
+                notifier.fatal('Caltech.tind.io failed to return hold data', details)
+                raise ServiceFailure(details)
+            try:
+                return json.loads(content.decode('utf-8'))
+            except ValueError as err:
+                details = 'exception reading data from tind.io: {}'.format(err)
+                notifier.fatal('Unable to get data from Caltech.tind.io circulation page', details)
+                raise ServiceFailure(details)
+
+    first = await page(0)
+    records_data = first.get('recordsTotal')
+    total = records_data[0][0] if records_data else 0
+    others = await asyncio.gather(*[page(start) for start in range(page_size, total, page_size)])
+    rows = []
+    for result in [first] + others:
+        rows.extend(result.get('data', []))
+    if __debug__: log('got {} rows from tind.io in {} pages', len(rows), len(others) + 1)
+    return PagedData(rows, {name: value for name, value in first.items() if name != 'data'})
+
+
+async def _request(session, method, url, notifier, failure_text, **kwargs):
+    # Returns the status code and the body of the response.  GET requests
+    # are retried after transient failures, the same way as by the sessions
+    # made by transport.new_session().  Other failures are fatal.
+    settings = transport_settings()
+    attempts = 1 + (settings['retries'] if method == 'GET' else 0)
+    for attempt in range(attempts):
+        if attempt:
+            increment('http_retries')
+            await asyncio.sleep(settings['retry_backoff'] * (2 ** (attempt - 1)))
+        start = time.perf_counter()
+        try:
+            async with session.request(method, url, **kwargs) as res:
+                content = await res.read()
+                status = res.status
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            if attempt + 1 < attempts:
+                continue
+            details = 'exception connecting to {}: {}'.format(urlsplit(url).netloc, err)
+            notifier.fatal(failure_text, details)
+            raise ServiceFailure(details)
+        elapsed = time.perf_counter() - start
+        increment('http_requests')
+        increment('http_seconds', elapsed)
+        if __debug__: log('{} {}', method, urlsplit(url).netloc, phase = 'http',
+                          status = status, elapsed_ms = round(elapsed * 1000))
+        if status not in _RETRY_STATUSES:
+            break
+    return status, content
+
+
+# Miscellaneous utilities.
+# .............................................................................
+
+def _requests_session(session):
+    # Returns a requests session with the same cookies as the aiohttp
+    # session, for code that fetches other TIND pages after the event loop
+    # is gone.
+    result = new_session()
+    result.headers.update({'User-Agent': _USER_AGENT_STRING})
+    for cookie in session.cookie_jar:
+        result.cookies.set(cookie.key, cookie.value, domain = cookie['domain'],
+                           path = cookie['path'] or '/')
+    return result
+
+
+def _cookie(session, name):
+    for cookie in session.cookie_jar:
+        if cookie.key == name:
+            return cookie.value
+    return None
@@ -10,16 +10,27 @@ This version (using a file) is immune to that problem.
 '''
 
 from   cryptography.fernet import Fernet
-import keyring
 from   oauth2client import client
 from   oauth2client.client import Storage
 from   os import path
 import threading
 
+from .credentials import cached_password, set_cached_password
+from .credentials import delete_cached_password
 from .debug import log
+from .exceptions import InternalError
 from .files import user_data_path
 
 
+_token_cache = {}
+'''
+Decrypted token contents, keyed by tuples of (token file path, user name).  Decrypting
+the file requires the encryption key from the keyring, so caching the result
+saves both the keyring lookup and the decryption on repeated accesses within
+the same process.
+'''
+
+
 class TokenStorage(client.Storage):
     '''Implementation of oauth2client.client.token_storage that stores the
     credentials in an encrypted file rather than in the keyring password field.
@@ -47,6 +58,7 @@ class TokenStorage(client.Storage):
         self._service_name = service_name + ' storage key'
         self._user_name = user_name
         self._storage_file = path.join(user_data_path(), 'token')
+        self._cache_key = (self._storage_file, user_name)
         if __debug__: log('token storage file is {}', self._storage_file)
 
 
@@ -56,44 +68,56 @@ class TokenStorage(client.Storage):
             oauth2client.client.Credentials
         '''
         credentials = None
-        key = keyring.get_password(self._service_name, self._user_name)
-        if key is not None and path.exists(self._storage_file):
-            if __debug__: log('retrieved stored encryption key')
-            crypto = Fernet(key)
-            content = None
-            with open(self._storage_file, 'rb') as token_file:
-                if __debug__: log('decrypting token from {}', self._storage_file)
-                try:
-                    content = crypto.decrypt(token_file.read()).decode()
-                except Exception as ex:
-                    raise InternalError('token file corrupted')
+        content = _token_cache.get(self._cache_key)
+        if content is not None:
+            if __debug__: log('using cached token for {}', self._storage_file)
+        else:
+            content = self._decrypted_content()
             if content is not None:
-                try:
-                    if __debug__: log('constructing credentials object')
-                    credentials = client.Credentials.new_from_json(content)
-                    credentials.set_store(self)
-                except ValueError:
-                    pass
-                except Exception as ex:
-                    raise InternalError('problem creating Credentials from token')
+                _token_cache[self._cache_key] = content
+        if content is not None:
+            try:
+                if __debug__: log('constructing credentials object')
+                credentials = client.Credentials.new_from_json(content)
+                credentials.set_store(self)
+            except ValueError:
+                pass
+            except Exception as ex:
+                raise InternalError('problem creating Credentials from token')
         return credentials
 
 
+    def _decrypted_content(self):
+        key = cached_password(self._service_name, self._user_name)
+        if key is None or not path.exists(self._storage_file):
+            return None
+        if __debug__: log('retrieved stored encryption key')
+        crypto = Fernet(key)
+        with open(self._storage_file, 'rb') as token_file:
+            if __debug__: log('decrypting token from {}', self._storage_file)
+            try:
+                return crypto.decrypt(token_file.read()).decode()
+            except Exception as ex:
+                raise InternalError('token file corrupted')
+
+
     def locked_put(self, credentials):
         '''Write Credentials to file.
         Args:
             credentials: Credentials, the credentials to store.
         '''
-        key = keyring.get_password(self._service_name, self._user_name)
+        key = cached_password(self._service_name, self._user_name)
         if key is None:
             if __debug__: log('generating and storing new encryption key')
             key = Fernet.generate_key().decode()
-            keyring.set_password(self._service_name, self._user_name, key)
+            set_cached_password(self._service_name, self._user_name, key)
 
         crypto = Fernet(key)
+        content = credentials.to_json()
         with open(self._storage_file, 'wb') as token_file:
             if __debug__: log('writing token to file {}', self._storage_file)
-            token_file.write(crypto.encrypt(credentials.to_json().encode()))
+            token_file.write(crypto.encrypt(content.encode()))
+        _token_cache[self._cache_key] = content
 
 
     def locked_delete(self):
@@ -102,4 +126,5 @@ class TokenStorage(client.Storage):
             credentials: Credentials, the credentials to store.
         '''
         if __debug__: log('deleting encryption key')
-        keyring.delete_password(self._service_name, self._user_name)
+        _token_cache.pop(self._cache_key, None)
+        delete_cached_password(self._service_name, self._user_name)
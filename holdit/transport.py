@@ -0,0 +1,140 @@
+'''
+transport.py: HTTP transport settings for talking to TIND and the Caltech IdP
+
+All of the HTTP traffic with caltech.tind.io and idp.caltech.edu goes through
+sessions created by new_session().  The sessions keep connections alive and
+pooled (so that the SAML steps and the final AJAX call reuse connections),
+apply connect and read timeouts to every request, retry idempotent requests
+that fail with transient errors, and ask for compressed responses.  The
+time taken by each request is written to the debug log and recorded in the
+run metrics.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import requests
+from   requests.adapters import HTTPAdapter
+import time
+from   urllib.parse import urlsplit
+from   urllib3.util.retry import Retry
+
+try:
+    import brotli
+    _ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    _ACCEPT_ENCODING = 'gzip, deflate'
+
+import holdit
+from holdit.metrics import increment
+from holdit.debug import log
+
+
+# Global variables.
+# .............................................................................
+
+_settings = {
+    'connect_timeout' : 10,             # Seconds.
+    'read_timeout'    : 60,             # Seconds.
+    'retries'         : 3,              # Max. retries of idempotent requests.
+    'retry_backoff'   : 0.5,            # Backoff factor between retries.
+    'pool_size'       : 10,             # Max. connections kept per host.
+}
+'''
+Transport settings.  These can be changed using configure().
+'''
+
+_RETRY_STATUSES = [500, 502, 503, 504]
+'''
+HTTP status codes that are considered transient and cause a retry.
+'''
+
+_RETRY_METHODS = ['HEAD', 'GET', 'OPTIONS']
+'''
+HTTP methods that are safe to retry.  POST requests (such as the login steps)
+are never retried automatically.
+'''
+
+
+# Class definitions.
+# .............................................................................
+
+class TimedSession(requests.Session):
+    '''A requests Session that applies default timeouts to all requests and
+    records how long each request took.'''
+
+    def __init__(self, timeout):
+        super().__init__()
+        self._timeout = timeout
+
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self._timeout)
+        start = time.perf_counter()
+        res = super().request(method, url, **kwargs)
+        elapsed = time.perf_counter() - start
+        increment('http_requests')
+        increment('http_seconds', elapsed)
+        retry_state = getattr(res.raw, 'retries', None)
+        if retry_state and retry_state.history:
+            increment('http_retries', len(retry_state.history))
+        if __debug__: log('{} {}', method, urlsplit(url).netloc, phase = 'http',
+                          status = res.status_code, elapsed_ms = round(elapsed * 1000))
+        return res
+
+
+# Exported functions.
+# .............................................................................
+
+def configure(**settings):
+    '''Changes the transport settings used by sessions created afterwards.
+    Recognized keyword arguments are connect_timeout, read_timeout, retries,
+    retry_backoff and pool_size.'''
+    for name, value in settings.items():
+        if name not in _settings:
+            raise ValueError('Unrecognized transport setting "{}"'.format(name))
+        if value is not None:
+            _settings[name] = type(_settings[name])(value)
+    if __debug__: log('transport settings: {}', _settings)
+
+
+def settings():
+    '''Returns a copy of the current transport settings.'''
+    return dict(_settings)
+
+
+def new_session():
+    '''Returns a new requests Session object configured for use with TIND
+    and the Caltech IdP.'''
+    session = TimedSession((_settings['connect_timeout'], _settings['read_timeout']))
+    adapter = HTTPAdapter(pool_connections = _settings['pool_size'],
+                          pool_maxsize = _settings['pool_size'],
+                          max_retries = _retry_policy())
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Accept-Encoding': _ACCEPT_ENCODING})
+    return session
+
+
+# Internal utilities.
+# .............................................................................
+
+def _retry_policy():
+    retries = _settings['retries']
+    args = dict(total = retries, connect = retries, read = retries,
+                status = retries, backoff_factor = _settings['retry_backoff'],
+                status_forcelist = _RETRY_STATUSES, raise_on_status = False)
+    try:
+        return Retry(allowed_methods = _RETRY_METHODS, **args)
+    except TypeError:
+        # Versions of urllib3 before 1.26 use a different argument name.
+        return Retry(method_whitelist = _RETRY_METHODS, **args)
@@ -0,0 +1,49 @@
+'''
+Tests for holdit/callnumbers.py.
+'''
+
+from holdit.callnumbers import sort_key
+
+
+def shelf_order(call_numbers):
+    return sorted(call_numbers, key = sort_key)
+
+
+def test_class_letters():
+    assert shelf_order(['QC1 .A2', 'QA1 .A2', 'Q1 .A2', 'QB1 .A2', 'B1 .A2']) \
+        == ['B1 .A2', 'Q1 .A2', 'QA1 .A2', 'QB1 .A2', 'QC1 .A2']
+
+
+def test_class_numbers_are_whole_numbers():
+    assert shelf_order(['QA76 .A2', 'QA9 .A2', 'QA300 .A2', 'QA76']) \
+        == ['QA9 .A2', 'QA76', 'QA76 .A2', 'QA300 .A2']
+
+
+def test_class_number_decimals_are_fractions():
+    assert shelf_order(['QA76.9 .A2', 'QA76.45 .A2', 'QA76 .A2', 'QA76.451 .A2']) \
+        == ['QA76 .A2', 'QA76.45 .A2', 'QA76.451 .A2', 'QA76.9 .A2']
+
+
+def test_cutters_are_decimals():
+    assert shelf_order(['QA76.9 .D3 C65', 'QA76.9 .D26 C65', 'QA76.9 .D3 B7', 'QA76.9 .C9']) \
+        == ['QA76.9 .C9', 'QA76.9 .D26 C65', 'QA76.9 .D3 B7', 'QA76.9 .D3 C65']
+
+
+def test_dates_and_volumes():
+    assert shelf_order(['QA76 .A2 2010 v.10', 'QA76 .A2 2010 v.9', 'QA76 .A2 2009']) \
+        == ['QA76 .A2 2009', 'QA76 .A2 2010 v.9', 'QA76 .A2 2010 v.10']
+
+
+def test_spacing_and_case_do_not_matter():
+    assert sort_key('qa76.9 .d3  c65') == sort_key('QA76.9.D3 C65')
+
+
+def test_kinds_of_call_numbers():
+    # LC call numbers come first, then Dewey, then anything else, and empty
+    # call numbers last.
+    assert shelf_order(['', 'Thesis 2019 v.2', '510.5 S3', 'QA76 .A2']) \
+        == ['QA76 .A2', '510.5 S3', 'Thesis 2019 v.2', '']
+    assert shelf_order(['510.5 S3', '510.45 S3', '510 S3', '005.1 K5']) \
+        == ['005.1 K5', '510 S3', '510.45 S3', '510.5 S3']
+    assert shelf_order(['Thesis 2019 v.10', 'Thesis 2019 v.2']) \
+        == ['Thesis 2019 v.2', 'Thesis 2019 v.10']
@@ -0,0 +1,20 @@
+'''
+Tests for holdit/dates.py.
+'''
+
+from datetime import datetime
+
+from holdit.dates import parsed_datetime
+
+
+def test_parsing_does_not_depend_on_call_order():
+    # Day-first dates are not accepted, so parsing one must not change how
+    # later strings of the same shape are read.
+    assert parsed_datetime('23/7/2018') is None
+    assert parsed_datetime('12/7/2018') == datetime(2018, 12, 7)
+
+
+def test_us_and_iso_dates():
+    assert parsed_datetime('7/23/2018 10:34:00') == datetime(2018, 7, 23, 10, 34)
+    assert parsed_datetime('2018-07-23 10:34:00') == datetime(2018, 7, 23, 10, 34)
+    assert parsed_datetime('  ') is None
@@ -0,0 +1,14 @@
+'''
+Tests for holdit/debug.py.
+'''
+
+from holdit.debug import log, recent_events
+
+
+def test_arguments_are_recorded_when_logged():
+    values = {'rows': 1}
+    names = ['a']
+    log('values {} names {}', values, names, seen = names)
+    values['rows'] = 2
+    names.append('b')
+    assert recent_events()[-1].endswith("values {'rows': 1} names ['a'] [seen=['a']]")
@@ -0,0 +1,72 @@
+'''
+Tests for holdit/exporter.py.
+'''
+
+import json
+import pytest
+
+import holdit.exporter
+import holdit.metrics
+from holdit.exporter import configure, export_metrics, _prometheus_text
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(holdit.exporter, 'user_data_path', lambda: str(tmp_path))
+    monkeypatch.setattr(holdit.metrics, '_values', {})
+    monkeypatch.setattr(holdit.exporter, '_settings', {'format': 'none', 'file': ''})
+    return tmp_path
+
+
+def test_prometheus_samples_have_the_same_labels():
+    values = {('http_requests', (('host', 'tind'),)): 3,
+              ('http_requests', (('host', 'idp'), ('status', '200'))): 2,
+              ('run_seconds', ()): 1.5}
+    lines = _prometheus_text(values).splitlines()
+    assert lines == [
+        '# HELP holdit_http_requests HTTP requests made.',
+        '# TYPE holdit_http_requests gauge',
+        'holdit_http_requests{host="idp",status="200"} 2',
+        'holdit_http_requests{host="tind",status=""} 3',
+        '# HELP holdit_run_seconds Duration of the last run.',
+        '# TYPE holdit_run_seconds gauge',
+        'holdit_run_seconds 1.5',
+    ]
+
+
+def test_prometheus_label_values_are_escaped():
+    values = {('stage_items', (('stage', 'a "b"\\c\nd'),)): 1}
+    assert 'holdit_stage_items{stage="a \\"b\\"\\\\c\\nd"} 1' in _prometheus_text(values)
+
+
+def test_export_is_off_by_default(data_dir):
+    assert export_metrics(True, 1.0) is None
+    assert list(data_dir.iterdir()) == []
+
+
+def test_json_export(data_dir):
+    configure(format = 'json', file = 'metrics.json')
+    holdit.metrics.increment('http_requests', host = 'tind')
+    file = export_metrics(True, 2.5)
+    assert file == str(data_dir / 'metrics.json')
+    with open(file) as f:
+        content = json.load(f)
+    metrics = {(m['name'], tuple(sorted(m['labels'].items()))): m['value']
+               for m in content['metrics']}
+    assert metrics[('http_requests', (('host', 'tind'),))] == 1
+    assert metrics[('run_success', ())] == 1
+    assert metrics[('run_seconds', ())] == 2.5
+    assert metrics[('http_retries', ())] == 0
+    assert metrics[('last_success_timestamp_seconds', ())] == content['timestamp']
+
+
+def test_failed_run_keeps_the_last_success(data_dir):
+    configure(format = 'prometheus')
+    export_metrics(True, 1.0)
+    first = (data_dir / 'holdit.prom').read_text()
+    last_success = [l for l in first.splitlines()
+                    if l.startswith('holdit_last_success_timestamp_seconds')]
+    export_metrics(False, 1.0)
+    text = (data_dir / 'holdit.prom').read_text()
+    assert 'holdit_run_success 0' in text.splitlines()
+    assert last_success and last_success[0] in text.splitlines()
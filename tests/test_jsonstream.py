@@ -0,0 +1,82 @@
+'''
+Tests for holdit/jsonstream.py.
+'''
+
+import json
+import pytest
+
+from holdit.jsonstream import JsonArrayStream
+
+
+_DOCUMENT = {
+    'recordsTotal' : 3,
+    'data'         : [['<a href="x">Smith, "J."</a>', 'ends in \\', 12.5],
+                      ['[not] {an} array', 'café – \U0001f4da', None],
+                      [], [True, False, -7]],
+    'draw'         : 1,
+}
+
+
+def chunks(text, size):
+    data = text.encode('utf-8')
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64, 100000])
+def test_chunk_boundaries(size):
+    # Small chunks split numbers, strings, escapes and multibyte characters.
+    stream = JsonArrayStream(chunks(json.dumps(_DOCUMENT), size), 'data')
+    assert list(stream) == _DOCUMENT['data']
+    assert stream.fields == {'recordsTotal': 3, 'draw': 1}
+
+
+def test_fields_before_array_are_available_during_iteration():
+    stream = JsonArrayStream(chunks(json.dumps(_DOCUMENT), 5), 'data')
+    rows = iter(stream)
+    next(rows)
+    assert stream.fields == {'recordsTotal': 3}
+
+
+def test_escaped_quotes_and_brackets_in_strings():
+    text = r'{"data": ["a \"quoted\" ] value", "}{,[", "\\", "\"]"]}'
+    assert list(JsonArrayStream(chunks(text, 1), 'data')) == json.loads(text)['data']
+
+
+def test_whitespace_between_tokens():
+    text = '\n{ "data" :\n [ 1 ,\t2 ] ,\r\n "n" : 0 }\n'
+    stream = JsonArrayStream(chunks(text, 1), 'data')
+    assert list(stream) == [1, 2]
+    assert stream.fields == {'n': 0}
+
+
+def test_empty_array_and_empty_object():
+    assert list(JsonArrayStream(chunks('{"data": []}', 1), 'data')) == []
+    assert list(JsonArrayStream(chunks('{"data" : [ ] }', 1), 'data')) == []
+    stream = JsonArrayStream(chunks('{}', 1), 'data')
+    assert list(stream) == []
+    assert stream.fields == {}
+
+
+@pytest.mark.parametrize('cut', [1, 10, 20, 40, -2, -1])
+def test_truncated_input_raises(cut):
+    text = json.dumps({'data': [[1, 'two'], [3, 'four']], 'draw': 1})
+    with pytest.raises(ValueError):
+        list(JsonArrayStream(chunks(text[:cut], 3), 'data'))
+
+
+def test_truncated_number_at_end_of_input_raises():
+    # A number that ends exactly at the end of a chunk may continue in the
+    # next chunk; at the end of the input it is complete but the object is not.
+    with pytest.raises(ValueError):
+        list(JsonArrayStream([b'{"data": [12', b'34'], 'data'))
+
+
+def test_number_split_across_chunks():
+    assert list(JsonArrayStream([b'{"data": [12', b'34]}'], 'data')) == [1234]
+
+
+def test_malformed_input_raises():
+    with pytest.raises(ValueError):
+        list(JsonArrayStream([b'{"data": [1 2]}'], 'data'))
+    with pytest.raises(ValueError):
+        list(JsonArrayStream([b'["data"]'], 'data'))
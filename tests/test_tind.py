@@ -0,0 +1,113 @@
+'''
+Tests for holdit/tind.py.
+'''
+
+import pytest
+
+from holdit.tind import TindRecord, _COLUMNS
+from holdit.tind import _requester_fast, _requester_soup, _item_fast, _item_soup
+from holdit.tind import _barcode_fast, _barcode_soup, _notice_fast, _notice_soup
+from holdit.tind import _date_requested_fast, _date_requested_soup
+from holdit.tind import _holds_count_fast, _holds_count_soup
+from holdit.tind import _location_fast, _location_soup
+
+
+# Fragments in the form TIND uses, and variations of it.  The fast extractor
+# of a column must either give the same values as the slow one, or give up
+# (return None) so that the slow one is used.
+
+_REQUESTER = [
+    '<a href="/admin2/bibcirculation/user?id=17">Smith, Jane</a><br/><small>Student</small>',
+    '<a href="/user?id=1&amp;x=2">O&#39;Brien, Se&aacute;n &amp; Co.</a><br><small> Faculty </small>',
+    '<A HREF="/user?id=3" class="x">Doe, John</A> <small class="muted">Staff</small>',
+    '<a href="/user?id=4">Lee, <b>Ann</b></a><small>Staff</small>',
+    '<a href="/user?id=5"></a><small></small>',
+]
+
+_ITEM = [
+    '<a href="/record/123">A Book &amp; Its Title</a><br/><small>on shelf</small>',
+    '<a href="/record/124">Lost Book</a><br/><small><span>Lost</span></small>',
+    '<a href="/record/125">Another</a><small>On hold</small>',
+    ('<a href="/record/126">Loaned Book</a><br/><small>'
+     '<i class="fa fa-clock" data-original-title="Due date: 2018-08-01\nRenewals: 0"></i> '
+     '<a href="/admin2/bibcirculation/loan?id=9">On Loan</a></small>'),
+    ('<a href="/record/127">Overdue</a><small><i data-original-title="Overdue"></i>'
+     '<a href="/loan?id=10"> Overdue </a></small>'),
+    '<a href="/record/128"><em>Nested</em> title</a><small>on shelf</small>',
+    '<a href="/record/129">No status</a><small></small>',
+]
+
+_BARCODE = [
+    '<a href="/record/123/edit">35047019382612</a><br/><span>Main</span><span>QA76.9 .D3 C65</span>',
+    '<a href="/record/1">1</a><span class="a">x</span> <span class="b"> QA1 .A2 &amp; v.2 </span>',
+    '<a href="/record/2">2</a><span><b>x</b></span><span>QA2</span>',
+    '<a href="/record/3">3</a><span>x</span><span>QA3</span><span>extra</span>',
+]
+
+_DATE_REQUESTED = [
+    '<span>2018-07-23 10:34:00</span>',
+    '<span class="date"> 7/23/2018 </span>',
+    '<span></span>',
+]
+
+_NOTICE = [
+    '<span data-original-title="2018-07-30">2</span>',
+    '<span data-original-title="">0</span>',
+    '<span class="x" data-original-title="a &amp; b"> 1 </span>',
+]
+
+_HOLDS_COUNT = [
+    '<p>1</p>',
+    '<p class="count"> 12 </p>',
+    '<p></p>',
+]
+
+_LOCATION = [
+    '<span data-original-title="Sherman Fairchild Library">SFL</span>',
+    '<span data-original-title="Caltech Archives &amp; Special Collections">ARCH</span>',
+    '<span data-original-title="">  </span>',
+]
+
+_CASES = ([(_requester_fast, _requester_soup, f) for f in _REQUESTER]
+          + [(_item_fast, _item_soup, f) for f in _ITEM]
+          + [(_barcode_fast, _barcode_soup, f) for f in _BARCODE]
+          + [(_date_requested_fast, _date_requested_soup, f) for f in _DATE_REQUESTED]
+          + [(_notice_fast, _notice_soup, f) for f in _NOTICE]
+          + [(_holds_count_fast, _holds_count_soup, f) for f in _HOLDS_COUNT]
+          + [(_location_fast, _location_soup, f) for f in _LOCATION])
+
+
+@pytest.mark.parametrize('fast, slow, fragment', _CASES)
+def test_fast_extractors_agree_with_parser(fast, slow, fragment):
+    values = fast(fragment)
+    if values is not None:
+        assert values == slow(fragment)
+
+
+def test_fast_extractors_handle_the_usual_forms():
+    # The forms TIND normally sends must not need the parser.
+    for fast, fragment in [(_requester_fast, _REQUESTER[0]), (_item_fast, _ITEM[0]),
+                           (_item_fast, _ITEM[3]), (_barcode_fast, _BARCODE[0]),
+                           (_date_requested_fast, _DATE_REQUESTED[0]),
+                           (_notice_fast, _NOTICE[0]), (_holds_count_fast, _HOLDS_COUNT[0]),
+                           (_location_fast, _LOCATION[0])]:
+        assert fast(fragment) is not None, fragment
+
+
+def test_record_fields_are_decoded_on_demand():
+    row = [_REQUESTER[0], _ITEM[3], _BARCODE[0], _DATE_REQUESTED[0], _NOTICE[0],
+           _HOLDS_COUNT[0], _LOCATION[0]]
+    record = TindRecord(row)
+    assert record.decoded_fields() == {}
+    assert record.item_loan_status == 'on loan'
+    assert record.date_due == '2018-08-01'
+    assert set(record.decoded_fields()) == set(_COLUMNS[1][1])
+    assert record.item_call_number == 'QA76.9 .D3 C65'
+    assert record.requester_name == 'Smith, Jane'
+    assert record.item_location_code == 'SFL'
+
+
+def test_unrecognized_fragments_use_the_parser():
+    extract = _COLUMNS[0][2]
+    assert _requester_fast(_REQUESTER[3]) is None
+    assert extract(_REQUESTER[3]) == _requester_soup(_REQUESTER[3])